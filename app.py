@@ -1,16 +1,54 @@
+from abc import ABC, abstractmethod
 from dataclasses import dataclass
+import asyncio
+import atexit
 import streamlit as st
 import speech_recognition as sr
 import google.generativeai as genai
 import os
+import hashlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 import json
+import math
+import random
+import re
+import sqlite3
+import unicodedata
+import zlib
+from collections import Counter, OrderedDict, deque
+from contextlib import contextmanager
+from functools import lru_cache
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from concurrent.futures import TimeoutError as FutureTimeoutError
+import itertools
 from audio_recorder_streamlit import audio_recorder
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 import io
-from typing import Dict, List, Any, Optional, Tuple
+import queue
+import struct
+import threading
+import numpy as np
+import grpc
+from google.ai.generativelanguage_v1beta.services.generative_service import (
+    GenerativeServiceClient, transports as gemini_transports)
+from google.auth import api_key as ga_api_key
+from requests.adapters import HTTPAdapter
+from typing import Callable, Deque, Dict, Iterable, Iterator, List, Any, Optional, Tuple
 import time
 import logging
 from dotenv import load_dotenv
 
+try:
+    from opentelemetry import trace as otel_trace
+except ImportError:  # OpenTelemetry is optional
+    otel_trace = None
+
+try:
+    from streamlit_webrtc import WebRtcMode, webrtc_streamer
+except ImportError:  # Live capture is optional
+    webrtc_streamer = None
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
@@ -19,7 +57,495 @@ load_dotenv()
 GEMINI_API_KEY = os.getenv('GEMINI_API')
 genai.configure(api_key=GEMINI_API_KEY)
 
-VOLUMIO_MODEL = genai.GenerativeModel("gemini-2.0-flash-exp")
+@dataclass
+class ResourceEntry:
+    """A registered resource and its lifecycle hooks"""
+    value: Any
+    health: Optional[Callable[[Any], bool]]
+    close: Optional[Callable[[Any], None]]
+    created: float
+    checked: float
+    healthy: bool = True
+    probing: bool = False
+
+class ResourceRegistry:
+    """Long-lived objects shared by every rerun and session in the process.
+
+    Streamlit re-executes this script on each rerun, so objects built at module
+    level are obtained from here instead of being recreated. Health probes run
+    in the background at most every ``check_interval`` seconds; a resource that
+    failed its last probe is closed and rebuilt from its factory on next access.
+    """
+    def __init__(self, check_interval: float = 60.0):
+        self.check_interval = check_interval
+        self._entries: Dict[str, ResourceEntry] = {}
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def get(self, name: str, factory: Callable[[], Any],
+            health: Optional[Callable[[Any], bool]] = None,
+            close: Optional[Callable[[Any], None]] = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(name)
+            build_lock = self._build_locks.setdefault(name, threading.Lock())
+        if entry is not None and self._check(name, entry):
+            return entry.value
+        # Factories run outside the registry lock: a slow one only blocks its own name
+        with build_lock:
+            with self._lock:
+                current = self._entries.get(name)
+            if current is not None and current is not entry:
+                return current.value
+            if current is not None:
+                logger.warning(f"Resource {name} is unhealthy, rebuilding")
+                self.reset(name)
+            start = time.time()
+            value = factory()
+            with self._lock:
+                self._entries[name] = ResourceEntry(value, health, close, start, start)
+            logger.info(f"Resource {name} created in {(time.time() - start) * 1000:.0f} ms")
+            return value
+
+    def _check(self, name: str, entry: ResourceEntry) -> bool:
+        """Result of the last probe, starting a new one in the background when due"""
+        with self._lock:
+            due = (entry.health is not None and not entry.probing
+                   and time.time() - entry.checked >= self.check_interval)
+            if due:
+                entry.checked = time.time()
+                entry.probing = True
+        if due:
+            threading.Thread(target=self._probe, args=(name, entry), daemon=True).start()
+        return entry.healthy
+
+    @staticmethod
+    def _probe(name: str, entry: ResourceEntry):
+        try:
+            entry.healthy = bool(entry.health(entry.value))
+        except Exception as e:
+            logger.warning(f"Health check for {name} raised: {e}")
+            entry.healthy = False
+        entry.probing = False
+        if not entry.healthy:
+            logger.warning(f"Resource {name} failed its health check")
+
+    def reset(self, name: str):
+        """Close a resource; the next access builds a new one"""
+        with self._lock:
+            entry = self._entries.pop(name, None)
+        if entry is not None and entry.close is not None:
+            try:
+                entry.close(entry.value)
+            except Exception as e:
+                logger.warning(f"Closing {name} failed: {e}")
+
+    def close_all(self):
+        for name in list(self._entries):
+            self.reset(name)
+
+    def status(self) -> List[Dict[str, Any]]:
+        with self._lock:
+            return [{"risorsa": name, "sano": entry.healthy,
+                     "età_s": round(time.time() - entry.created)}
+                    for name, entry in self._entries.items()]
+
+@st.cache_resource
+def resource_registry() -> ResourceRegistry:
+    """Process-wide registry, kept by Streamlit across reruns and sessions"""
+    registry = ResourceRegistry()
+    atexit.register(registry.close_all)
+    return registry
+
+RESOURCES = resource_registry()
+
+def _shutdown_executor(executor: ThreadPoolExecutor):
+    executor.shutdown(wait=False, cancel_futures=True)
+
+class RemoteUnavailableError(Exception):
+    """A remote dependency is shedding load or its circuit is open"""
+
+class CircuitBreaker:
+    """Opens after too many failed or slow calls, then lets a single probe through"""
+    def __init__(self, name: str, error_rate: float = 0.5, slow_rate: float = 0.5,
+                 slow_call_s: float = 10.0, window: int = 20, min_calls: int = 5,
+                 reset_timeout_s: float = 30.0):
+        self.name = name
+        self.error_rate = error_rate
+        self.slow_rate = slow_rate
+        self.slow_call_s = slow_call_s
+        self.min_calls = min_calls
+        self.reset_timeout_s = reset_timeout_s
+        self.state = "closed"
+        self._outcomes: Deque[Tuple[bool, bool]] = deque(maxlen=window)
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        """Whether a call may go through now"""
+        with self._lock:
+            if self.state == "open" and time.time() - self._opened_at >= self.reset_timeout_s:
+                self.state = "half_open"
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record(self, success: bool, latency_s: float):
+        """Record a call outcome and update the state"""
+        with self._lock:
+            slow = latency_s > self.slow_call_s
+            if self.state == "half_open":
+                self._probing = False
+                if success and not slow:
+                    self.state = "closed"
+                    self._outcomes.clear()
+                else:
+                    self._open()
+                return
+            self._outcomes.append((success, slow))
+            if len(self._outcomes) >= self.min_calls:
+                failures = sum(1 for ok, _ in self._outcomes if not ok) / len(self._outcomes)
+                slow_calls = sum(1 for _, is_slow in self._outcomes if is_slow) / len(self._outcomes)
+                if failures >= self.error_rate or slow_calls >= self.slow_rate:
+                    self._open()
+
+    def cancel_probe(self):
+        """Let another probe through when the admitted one was never made or ended without an outcome"""
+        with self._lock:
+            if self.state == "half_open":
+                self._probing = False
+
+    def _open(self):
+        logger.warning(f"Circuit for {self.name} opened")
+        self.state = "open"
+        self._opened_at = time.time()
+        self._outcomes.clear()
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit: grows by one per window of good calls, halves on failure or slowness"""
+    def __init__(self, initial: float = 8, minimum: float = 1, maximum: float = 64,
+                 target_latency_s: float = 5.0):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_latency_s = target_latency_s
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        with self._lock:
+            if self.in_flight >= int(self.limit):
+                return False
+            self.in_flight += 1
+            return True
+
+    def release(self, success: Optional[bool], latency_s: float):
+        """Free a slot; ``success`` None means the call was cancelled and says nothing"""
+        with self._lock:
+            self.in_flight -= 1
+            if success is None:
+                return
+            if success and latency_s <= self.target_latency_s:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            else:
+                self.limit = max(self.minimum, self.limit / 2)
+
+class RemoteGuard:
+    """Circuit breaker and adaptive limiter around one remote dependency"""
+    def __init__(self, name: str, breaker: Optional[CircuitBreaker] = None,
+                 limiter: Optional[AdaptiveLimiter] = None):
+        self.name = name
+        self.breaker = breaker or CircuitBreaker(name)
+        self.limiter = limiter or AdaptiveLimiter()
+        self.rejected = 0
+
+    def acquire(self) -> float:
+        """Reserve a call slot, failing fast if the dependency is unhealthy or saturated"""
+        if not self.breaker.allow():
+            self.rejected += 1
+            raise RemoteUnavailableError(f"{self.name}: circuit open")
+        if not self.limiter.try_acquire():
+            self.breaker.cancel_probe()
+            self.rejected += 1
+            raise RemoteUnavailableError(f"{self.name}: concurrency limit reached")
+        return time.perf_counter()
+
+    def release(self, start: float, success: Optional[bool]):
+        """Free the slot; ``success`` None means the call was abandoned and says nothing"""
+        latency = time.perf_counter() - start
+        self.limiter.release(success, latency)
+        if success is None:
+            self.breaker.cancel_probe()
+        else:
+            self.breaker.record(success, latency)
+
+    def call(self, func, *args, is_failure: Callable[[BaseException], bool] = lambda e: True, **kwargs):
+        """Run a blocking call under the guard"""
+        start = self.acquire()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self.release(start, not is_failure(e))
+            raise
+        self.release(start, True)
+        return result
+
+    def status(self) -> Dict[str, Any]:
+        return {"circuit": self.breaker.state, "limit": round(self.limiter.limit, 1),
+                "in_flight": self.limiter.in_flight, "rejected": self.rejected}
+
+GEMINI_GUARD = RESOURCES.get("gemini_guard", lambda: RemoteGuard("gemini"))
+SPEECH_GUARD = RESOURCES.get("speech_guard", lambda: RemoteGuard("google_speech"))
+
+class GeminiClient:
+    """Shared Gemini model with a persistent, tuned connection and bounded in-flight requests"""
+    def __init__(self, model_name: str, api_key: Optional[str], transport: str = "grpc",
+                 endpoint: Optional[str] = None, max_in_flight: int = 8,
+                 pool_size: int = 8, keepalive_s: int = 30, guard: Optional[RemoteGuard] = None):
+        self.model_name = model_name
+        self.guard = guard or GEMINI_GUARD
+        self.transport = transport
+        self.max_in_flight = max_in_flight
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._in_flight = 0
+        self._lock = threading.Lock()
+        self.model = genai.GenerativeModel(model_name)
+        self._transport = None
+        api_key = api_key or os.getenv('GEMINI_API_KEY') or os.getenv('GOOGLE_API_KEY')
+        if api_key:
+            self._transport = self._create_transport(api_key, endpoint, pool_size, keepalive_s)
+            # GenerativeModel has no public hook for a custom client
+            self.model._client = GenerativeServiceClient(transport=self._transport)
+        else:
+            logger.warning("No Gemini API key found, using the SDK default client")
+
+    def _create_transport(self, api_key: str, endpoint: Optional[str],
+                          pool_size: int, keepalive_s: int):
+        """Build a transport whose connections stay open and are reused across requests"""
+        credentials = ga_api_key.Credentials(api_key)
+        host = endpoint or GenerativeServiceClient.DEFAULT_ENDPOINT
+        if self.transport == "rest":
+            transport = gemini_transports.GenerativeServiceRestTransport(
+                host=host, credentials=credentials)
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+            transport._session.mount("https://", adapter)
+            transport._session.mount("http://", adapter)
+            return transport
+
+        keepalive_options = [
+            ("grpc.keepalive_time_ms", keepalive_s * 1000),
+            ("grpc.keepalive_timeout_ms", 10000),
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.max_pings_without_data", 0)
+        ]
+
+        def create_channel(*args, options=(), **kwargs):
+            return gemini_transports.GenerativeServiceGrpcTransport.create_channel(
+                *args, options=list(options) + keepalive_options, **kwargs)
+
+        return gemini_transports.GenerativeServiceGrpcTransport(
+            host=host, credentials=credentials, channel=create_channel)
+
+    def warmup(self, timeout: float = 5.0):
+        """Open the connection ahead of the first request, paying the TLS handshake up front"""
+        try:
+            if isinstance(self._transport, gemini_transports.GenerativeServiceGrpcTransport):
+                grpc.channel_ready_future(self._transport.grpc_channel).result(timeout=timeout)
+            elif self._transport is not None:
+                self._transport._session.head(f"{self._transport._host}/", timeout=timeout)
+        except Exception as e:
+            logger.debug(f"Gemini warmup failed: {e}")
+
+    def healthy(self, timeout: float = 5.0) -> bool:
+        """Whether the pooled connection can reach the endpoint"""
+        if isinstance(self._transport, gemini_transports.GenerativeServiceGrpcTransport):
+            try:
+                grpc.channel_ready_future(self._transport.grpc_channel).result(timeout=timeout)
+            except grpc.FutureTimeoutError:
+                return False
+        elif self._transport is not None:
+            # Any HTTP answer means the connection works
+            self._transport._session.head(f"{self._transport._host}/", timeout=timeout)
+        return True
+
+    def close(self):
+        """Close the pooled connection"""
+        if self._transport is not None:
+            self._transport.close()
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _acquire(self):
+        """Take an in-flight slot without waiting; callers queueing here would pile up threads"""
+        if not self._slots.acquire(blocking=False):
+            raise RemoteUnavailableError(f"{self.guard.name}: {self.max_in_flight} requests in flight")
+        with self._lock:
+            self._in_flight += 1
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+        self._slots.release()
+
+    def _begin(self) -> float:
+        """Take a guard slot and an in-flight slot; returns the call start time"""
+        start = self.guard.acquire()
+        try:
+            self._acquire()
+        except RemoteUnavailableError:
+            self.guard.release(start, None)
+            raise
+        return start
+
+    def _end(self, start: float, success: Optional[bool]):
+        self._release()
+        self.guard.release(start, success)
+
+    def generate_content(self, prompt: str, stream: bool = False, **kwargs):
+        """GenerativeModel.generate_content, holding an in-flight slot until the response is consumed.
+
+        Raises ``RemoteUnavailableError`` without calling the API when the guard sheds the request.
+        A stream takes its slots on the first iteration, so a stream that is never
+        started holds nothing.
+        """
+        if stream:
+            return self._stream(prompt, kwargs)
+        start = self._begin()
+        try:
+            response = self.model.generate_content(prompt, **kwargs)
+        except BaseException:
+            self._end(start, False)
+            raise
+        self._end(start, True)
+        return response
+
+    def _stream(self, prompt: str, kwargs: Dict[str, Any]):
+        start = self._begin()
+        success: Optional[bool] = False
+        try:
+            yield from self.model.generate_content(prompt, stream=True, **kwargs)
+            success = True
+        except GeneratorExit:
+            # Closed by the consumer (e.g. a losing hedge): not a verdict on the backend
+            success = None
+            raise
+        finally:
+            self._end(start, success)
+
+    def generate_content_hedged(self, prompt: str, policy: "HedgingPolicy", **kwargs) -> Iterator[Any]:
+        """Streaming generate_content with a speculative duplicate request.
+
+        If the first chunk has not arrived by the policy's delay, a second request
+        is sent and the stream answering first is used; the other one is closed.
+        """
+        def first_chunk():
+            stream = self.generate_content(prompt, stream=True, **kwargs)
+            return next(stream, None), stream
+
+        def discard(future: Future):
+            if not future.cancelled() and future.exception() is None:
+                future.result()[1].close()
+
+        start = time.perf_counter()
+        policy.on_request()
+        pending = {HEDGE_EXECUTOR.submit(first_chunk)}
+        done, _ = wait(pending, timeout=policy.hedge_delay())
+        if not done and policy.try_spend():
+            pending.add(HEDGE_EXECUTOR.submit(first_chunk))
+
+        winner, error = None, None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and winner is None:
+                    winner = future
+                elif future.exception() is None:
+                    discard(future)
+                else:
+                    error = future.exception()
+        for future in pending:
+            if not future.cancel():
+                future.add_done_callback(discard)
+        if winner is None:
+            raise error
+        policy.observe(time.perf_counter() - start)
+
+        first, stream = winner.result()
+        return itertools.chain([first] if first is not None else [], stream)
+
+class HedgingPolicy:
+    """When to send a hedged duplicate request, within a token-bucket budget"""
+    def __init__(self, quantile: float = 90, budget_ratio: float = 0.1, max_tokens: float = 10,
+                 min_samples: int = 20, window: int = 200):
+        self.quantile = quantile
+        self.budget_ratio = budget_ratio
+        self.max_tokens = max_tokens
+        self.min_samples = min_samples
+        self.hedged = 0
+        self._tokens = max_tokens
+        self._latencies: Deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def on_request(self):
+        """Each request earns a fraction of a hedge"""
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.budget_ratio)
+
+    def try_spend(self) -> bool:
+        """Take a token for a hedge if the budget allows it"""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            self.hedged += 1
+            return True
+
+    def observe(self, latency_s: float):
+        with self._lock:
+            self._latencies.append(latency_s)
+
+    def hedge_delay(self) -> Optional[float]:
+        """Running latency percentile, None (never hedge) until enough samples exist"""
+        with self._lock:
+            if len(self._latencies) < self.min_samples:
+                return None
+            return float(np.percentile(self._latencies, self.quantile))
+
+# Runs hedged requests; larger than the in-flight cap so hedges are never starved by it
+HEDGE_EXECUTOR = RESOURCES.get(
+    "hedge_executor", lambda: ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge"),
+    close=_shutdown_executor)
+HEDGING_POLICY = (RESOURCES.get("hedging_policy", HedgingPolicy)
+                  if os.getenv('VOLUMIO_HEDGING') == '1' else None)
+
+def _create_gemini_client() -> GeminiClient:
+    client = GeminiClient(
+        "gemini-2.0-flash-exp", GEMINI_API_KEY,
+        transport=os.getenv('VOLUMIO_GEMINI_TRANSPORT', 'grpc'),
+        endpoint=os.getenv('VOLUMIO_GEMINI_ENDPOINT'),
+        max_in_flight=int(os.getenv('VOLUMIO_GEMINI_MAX_IN_FLIGHT', '8')),
+        pool_size=int(os.getenv('VOLUMIO_GEMINI_POOL_SIZE', '8')),
+        keepalive_s=int(os.getenv('VOLUMIO_GEMINI_KEEPALIVE_S', '30')),
+        guard=GEMINI_GUARD
+    )
+    threading.Thread(target=client.warmup, daemon=True).start()
+    return client
+
+VOLUMIO_MODEL = RESOURCES.get("gemini", _create_gemini_client,
+                              health=GeminiClient.healthy, close=GeminiClient.close)
+
+# Speech-to-text backend: google, vosk, whisper_cpp or stub
+STT_BACKEND = os.getenv('VOLUMIO_STT_BACKEND', 'google')
+STT_MODEL = os.getenv('VOLUMIO_STT_MODEL')
+# Smallest format the recognizers need: 16 kHz mono 16-bit
+STT_SAMPLE_RATE = 16000
+# Live capture with partial transcripts (requires streamlit-webrtc)
+STREAMING_CAPTURE = os.getenv('VOLUMIO_STREAMING') == '1'
 
 @dataclass
 class MusicCategory:
@@ -37,14 +563,934 @@ MUSIC_CATEGORIES = {
                     "Walking": MusicCategory("Walking", "100-120", "Ritmi naturali e brani cantautorali")
                     }
 
+_current_span: contextvars.ContextVar[Optional[Tuple[str, str]]] = contextvars.ContextVar(
+    "current_span", default=None)
+
+class Tracer:
+    """Per-stage latency spans with percentile, Prometheus and OpenTelemetry export"""
+    def __init__(self, max_samples: int = 1000):
+        self.max_samples = max_samples
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+        self._sums: Dict[str, float] = {}
+        self._spans: Deque[Dict[str, Any]] = deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+        self._otel = otel_trace.get_tracer("volumio") if otel_trace else None
+
+    @contextmanager
+    def span(self, name: str, **attributes: Any) -> Iterator[None]:
+        """Time a block as a span, nested under the current one"""
+        parent = _current_span.get()
+        trace_id = parent[0] if parent else os.urandom(16).hex()
+        span_id = os.urandom(8).hex()
+        token = _current_span.set((trace_id, span_id))
+        start_ns = time.time_ns()
+        start = time.perf_counter()
+        otel_cm = self._otel.start_as_current_span(name, attributes=attributes) if self._otel else None
+        if otel_cm:
+            otel_cm.__enter__()
+        exc_info: Tuple[Any, Any, Any] = (None, None, None)
+        try:
+            yield
+        except BaseException as e:
+            exc_info = (type(e), e, e.__traceback__)
+            raise
+        finally:
+            if otel_cm:
+                # Passing the exception marks the OTel span as failed
+                otel_cm.__exit__(*exc_info)
+            _current_span.reset(token)
+            self.record(name, (time.perf_counter() - start) * 1000, {
+                "name": name,
+                "trace_id": trace_id,
+                "span_id": span_id,
+                "parent_span_id": parent[1] if parent else None,
+                "start_time_unix_nano": start_ns,
+                "end_time_unix_nano": time.time_ns(),
+                "status": "ERROR" if exc_info[1] is not None else "OK",
+                "attributes": attributes
+            })
+
+    def record(self, name: str, duration_ms: float, span: Optional[Dict[str, Any]] = None):
+        """Record a duration measured outside of a ``span`` block"""
+        with self._lock:
+            self._samples.setdefault(name, deque(maxlen=self.max_samples)).append(duration_ms)
+            self._counts[name] = self._counts.get(name, 0) + 1
+            self._sums[name] = self._sums.get(name, 0.0) + duration_ms
+            if span is not None:
+                self._spans.append(span)
+
+    def percentiles(self) -> Dict[str, Dict[str, float]]:
+        """p50/p95/p99 latency in milliseconds per stage, over the recent samples"""
+        with self._lock:
+            samples = {name: list(values) for name, values in self._samples.items()}
+        stats = {}
+        for name, values in samples.items():
+            p50, p95, p99 = np.percentile(values, [50, 95, 99])
+            stats[name] = {"count": self._counts[name], "p50": round(p50, 1),
+                           "p95": round(p95, 1), "p99": round(p99, 1)}
+        return stats
+
+    def prometheus(self) -> str:
+        """Stage latencies in the Prometheus text exposition format"""
+        lines = ["# HELP volumio_stage_latency_ms Latency of each pipeline stage in milliseconds",
+                 "# TYPE volumio_stage_latency_ms summary"]
+        for name, stats in sorted(self.percentiles().items()):
+            for quantile in ("p50", "p95", "p99"):
+                lines.append(f'volumio_stage_latency_ms{{stage="{name}",quantile="0.{quantile[1:]}"}} '
+                             f'{stats[quantile]}')
+            lines.append(f'volumio_stage_latency_ms_sum{{stage="{name}"}} {round(self._sums[name], 3)}')
+            lines.append(f'volumio_stage_latency_ms_count{{stage="{name}"}} {stats["count"]}')
+        return "\n".join(lines) + "\n"
+
+    def export_spans(self) -> List[Dict[str, Any]]:
+        """Recent spans as OpenTelemetry-compatible records"""
+        with self._lock:
+            return list(self._spans)
+
+TRACER = RESOURCES.get("tracer", Tracer)
+
+class MetricsServer:
+    """HTTP endpoint serving the tracer's Prometheus metrics at /metrics"""
+    def __init__(self, tracer: Tracer, port: int, host: str = "0.0.0.0"):
+        self.tracer = tracer
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+
+    def _handler(self):
+        tracer = self.tracer
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                payload = tracer.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+        return Handler
+
+    def start(self) -> "MetricsServer":
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def _start_metrics_server() -> Optional[MetricsServer]:
+    """Metrics endpoint on VOLUMIO_METRICS_PORT; unset disables it"""
+    port = os.getenv('VOLUMIO_METRICS_PORT')
+    if not port:
+        return None
+    try:
+        return MetricsServer(TRACER, int(port)).start()
+    except (OSError, ValueError) as e:
+        logger.error(f"Could not serve metrics on port {port}: {e}")
+        return None
+
+METRICS_SERVER = RESOURCES.get("metrics_server", _start_metrics_server,
+                               close=lambda server: server is not None and server.stop())
+
+# Function words ignored when comparing utterances
+ITALIAN_STOPWORDS = frozenset("""
+a ad al alla alle allo ai agli che chi ci come con da dal dalla dei del della delle di e ed
+gli ha ho i il in io la le lo ma mi mio mia nel nella o per po poco qualcosa quello
+questo se si sono su sto tra un una uno vorrei voglio vuoi adesso ora ancora molto
+""".split())
+# Kept by normalize_text: they invert the intent of the words around them
+NEGATIONS = frozenset("non ne mai senza".split())
+
+def normalize_text(text: str) -> str:
+    """Normalize an utterance: lowercase, strip accents and punctuation, drop stopwords"""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    tokens = re.findall(r"[a-z0-9]+", text)
+    return " ".join(t for t in tokens if t not in ITALIAN_STOPWORDS)
+
+def _text_vector(normalized: str) -> Counter:
+    """Character trigram vector of a normalized utterance"""
+    padded = f" {normalized} "
+    return Counter(padded[i:i + 3] for i in range(len(padded) - 2))
+
+def _cosine(a: Counter, b: Counter) -> float:
+    """Cosine similarity between two sparse vectors"""
+    if not a or not b:
+        return 0.0
+    dot = sum(count * b[gram] for gram, count in a.items() if gram in b)
+    norm = math.sqrt(sum(v * v for v in a.values())) * math.sqrt(sum(v * v for v in b.values()))
+    return dot / norm
+
+class SemanticCache:
+    """LRU/TTL cache of analyses keyed on normalized text, with similarity lookup"""
+    def __init__(self, maxsize: int = 256, ttl: float = 3600, threshold: float = 0.85):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.threshold = threshold
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[Counter, Dict[str, Any], float]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, text: str) -> Optional[Dict[str, Any]]:
+        """Return a cached analysis for a similar utterance, if any"""
+        key = normalize_text(text)
+        now = time.time()
+        with self._lock:
+            self._evict_expired(now)
+            if key not in self._entries:
+                vector = _text_vector(key)
+                negations = NEGATIONS.intersection(key.split())
+                best_score = 0.0
+                for candidate, (candidate_vector, _, _) in self._entries.items():
+                    # A negation flips the intent however similar the rest of the text is
+                    if NEGATIONS.intersection(candidate.split()) != negations:
+                        continue
+                    score = _cosine(vector, candidate_vector)
+                    if score > best_score:
+                        key, best_score = candidate, score
+                if best_score < self.threshold:
+                    self.misses += 1
+                    return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(self._entries[key][1])
+
+    def put(self, text: str, result: Dict[str, Any]):
+        """Store an analysis for an utterance"""
+        key = normalize_text(text)
+        with self._lock:
+            self._entries[key] = (_text_vector(key), dict(result), time.time())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _evict_expired(self, now: float):
+        """Drop entries older than the TTL"""
+        expired = [k for k, (_, _, stored_at) in self._entries.items() if now - stored_at > self.ttl]
+        for key in expired:
+            del self._entries[key]
+
+    def stats(self) -> Dict[str, Any]:
+        """Hit/miss counters and current size"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            "size": len(self._entries)
+        }
+
+ANALYSIS_CACHE = RESOURCES.get("analysis_cache", SemanticCache)
+
+class PersistentCache:
+    """SQLite analysis cache shared by all processes using the same file.
+
+    Entries are keyed by normalized text, prompt version and model name, expire
+    after ``ttl`` seconds and the oldest are evicted beyond ``max_entries``.
+    """
+    def __init__(self, path: str, model_name: str, ttl: float = 7 * 24 * 3600,
+                 max_entries: int = 50000, mmap_bytes: int = 64 * 1024 * 1024):
+        self.path = path
+        self.model_name = model_name
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._puts = 0
+        # One connection for all threads: per-thread connections outlive the
+        # short-lived executor and script threads that open them
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=5.0, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(f"PRAGMA mmap_size={mmap_bytes}")
+        with self._lock, self._conn as conn:
+            conn.execute("""CREATE TABLE IF NOT EXISTS analyses (
+                key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL)""")
+            conn.execute("CREATE INDEX IF NOT EXISTS analyses_created ON analyses (created)")
+            conn.execute("""CREATE TABLE IF NOT EXISTS examples (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, text TEXT NOT NULL, label TEXT NOT NULL,
+                predicted TEXT, confidence REAL NOT NULL, created REAL NOT NULL)""")
+
+    def healthy(self) -> bool:
+        try:
+            with self._lock:
+                self._conn.execute("SELECT 1").fetchone()
+            return True
+        except sqlite3.Error:
+            return False
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+    def _key(self, text: str, prompt_version: str) -> str:
+        return hashlib.sha1(f"{self.model_name}|{prompt_version}|{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def get(self, text: str, prompt_version: str) -> Optional[Dict[str, Any]]:
+        key = self._key(text, prompt_version)
+        try:
+            with self._lock:
+                row = self._conn.execute(
+                    "SELECT value FROM analyses WHERE key = ? AND created > ?",
+                    (key, time.time() - self.ttl)).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"Persistent cache read failed: {e}")
+            return None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, text: str, prompt_version: str, result: Dict[str, Any]):
+        key, value = self._key(text, prompt_version), json.dumps(result)
+        try:
+            with self._lock, self._conn as conn:
+                conn.execute("INSERT OR REPLACE INTO analyses (key, value, created) VALUES (?, ?, ?)",
+                             (key, value, time.time()))
+                self._puts += 1
+                if self._puts % 100 == 0:
+                    self._evict(conn)
+        except sqlite3.Error as e:
+            logger.error(f"Persistent cache write failed: {e}")
+
+    def add_example(self, text: str, label: str, predicted: Optional[str], confidence: float):
+        """Record a model label together with what the local classifier predicted beforehand"""
+        try:
+            with self._lock, self._conn as conn:
+                conn.execute("""INSERT INTO examples (text, label, predicted, confidence, created)
+                    VALUES (?, ?, ?, ?, ?)""", (text, label, predicted, confidence, time.time()))
+        except sqlite3.Error as e:
+            logger.error(f"Training example write failed: {e}")
+
+    def examples(self, limit: Optional[int] = None) -> List[Tuple[str, str, Optional[str], float]]:
+        """Most recent training examples, oldest first"""
+        try:
+            with self._lock:
+                rows = self._conn.execute(
+                    "SELECT text, label, predicted, confidence FROM examples ORDER BY id DESC LIMIT ?",
+                    (limit if limit is not None else self.max_entries,)).fetchall()
+        except sqlite3.Error as e:
+            logger.error(f"Training example read failed: {e}")
+            return []
+        return rows[::-1]
+
+    def _evict(self, conn: sqlite3.Connection):
+        """Drop expired entries, then the oldest ones beyond the size bound"""
+        conn.execute("DELETE FROM analyses WHERE created <= ?", (time.time() - self.ttl,))
+        conn.execute("""DELETE FROM analyses WHERE key IN (
+            SELECT key FROM analyses ORDER BY created DESC LIMIT -1 OFFSET ?)""", (self.max_entries,))
+        conn.execute("""DELETE FROM examples WHERE id IN (
+            SELECT id FROM examples ORDER BY id DESC LIMIT -1 OFFSET ?)""", (self.max_entries,))
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0}
+
+def _open_persistent_cache() -> Optional[PersistentCache]:
+    """Persistent cache at VOLUMIO_CACHE_PATH; an empty value disables it"""
+    path = os.getenv('VOLUMIO_CACHE_PATH', 'volumio_cache.sqlite3')
+    if not path:
+        return None
+    try:
+        return PersistentCache(path, VOLUMIO_MODEL.model_name)
+    except sqlite3.Error as e:
+        logger.error(f"Could not open persistent cache at {path}: {e}")
+        return None
+
+PERSISTENT_CACHE = RESOURCES.get(
+    "persistent_cache", _open_persistent_cache,
+    health=lambda cache: cache is None or cache.healthy(),
+    close=lambda cache: cache is not None and cache.close())
+
+# Default synonyms and genre examples for the local keyword fast path
+CATEGORY_SYNONYMS = {
+                    "Running": ["correre", "corsa", "corro", "corri", "jogging", "allenamento", "allenarmi", "allenarsi", "palestra", "sport"],
+                    "Kitchen": ["cucinare", "cucinando", "cucino", "cucina", "cena", "cenare", "pranzo", "ricetta", "ospiti", "aperitivo"],
+                    "Ambient": ["atmosfera", "atmosferico", "atmosferica", "elettronica", "sottofondo", "soundscape"],
+                    "Relaxing": ["rilassarmi", "rilassarsi", "rilassare", "relax", "rilassante", "stress", "stressato", "stressata", "stressante", "calma", "dormire", "meditare"],
+                    "Working": ["lavorare", "lavoro", "lavorando", "studiare", "studio", "studiando", "concentrarmi", "concentrato", "concentrata", "concentrazione"],
+                    "Walking": ["camminare", "camminata", "passeggiata", "passeggiare", "cammino", "passeggio"]
+                    }
+
+CATEGORY_GENRES = {
+                  "Running": ["electronic dance", "rock energico"],
+                  "Kitchen": ["funk", "pop italiano"],
+                  "Ambient": ["ambient", "downtempo"],
+                  "Relaxing": ["ambient drone", "piano minimal"],
+                  "Working": ["lo-fi", "classica contemporanea"],
+                  "Walking": ["indie folk", "cantautorato"]
+                  }
+
+def _stem(token: str) -> str:
+    """Crude Italian stemmer: keep the first five characters"""
+    return token[:5]
+
+def category_result(cat: MusicCategory, reasoning: str) -> Dict[str, Any]:
+    """Analysis result for a category chosen locally, without the model"""
+    return {
+        "flow_consigliato": cat.name,
+        "bpm_range": f"{cat.bpm_range} BPM",
+        "caratteristiche": [cat.description.lower()],
+        "esempi_genere": CATEGORY_GENRES.get(cat.name, []),
+        "percezione_emotiva": f"intento riconosciuto: {cat.name.lower()}",
+        "reasoning": reasoning
+    }
+
+class KeywordIndex:
+    """Precompiled keyword index answering unambiguous intents locally.
+
+    Only category names and explicit synonyms are indexed, as whole normalized
+    tokens: descriptions are full of generic words (brani, ritmi, sotto...) and
+    prefixes match unrelated words.
+    """
+    def __init__(self, categories: Dict[str, MusicCategory],
+                 synonyms: Optional[Dict[str, List[str]]] = None):
+        self.categories = categories
+        self.synonyms: Dict[str, List[str]] = {name: [] for name in categories}
+        for name, words in (synonyms or {}).items():
+            self.synonyms.setdefault(name, []).extend(words)
+        self._compile()
+
+    def add_synonyms(self, category: str, words: List[str]):
+        """Extend the synonyms of a category and rebuild the index"""
+        if category not in self.categories:
+            raise KeyError(f"Unknown category: {category}")
+        self.synonyms[category].extend(words)
+        self._compile()
+
+    def _compile(self):
+        """Map each keyword to the categories using it, keeping only unambiguous ones"""
+        owners: Dict[str, set] = {}
+        for name, cat in self.categories.items():
+            terms = [cat.name] + self.synonyms.get(name, [])
+            for token in set(normalize_text(" ".join(terms)).split()):
+                owners.setdefault(token, set()).add(name)
+        self._index = {token: names.pop() for token, names in owners.items() if len(names) == 1}
+
+    def match(self, text: str) -> Optional[str]:
+        """Return the only category matched by the text, or None if ambiguous or negated"""
+        tokens = normalize_text(text).split()
+        if NEGATIONS.intersection(tokens):
+            return None
+        matched = {self._index[token] for token in tokens if token in self._index}
+        return matched.pop() if len(matched) == 1 else None
+
+    def best_match(self, text: str) -> Optional[str]:
+        """Return the category with the most keyword hits, even if others match too"""
+        hits = Counter(self._index[token] for token in normalize_text(text).split()
+                       if token in self._index)
+        return hits.most_common(1)[0][0] if hits else None
+
+    def classify(self, text: str) -> Optional[Dict[str, Any]]:
+        """Build an analysis result for high-confidence inputs, None otherwise"""
+        name = self.match(text)
+        return self.classify_as(name) if name is not None else None
+
+    def classify_as(self, name: str) -> Dict[str, Any]:
+        """Build an analysis result for a known category"""
+        return category_result(self.categories[name],
+                               "Corrispondenza diretta con parole chiave della categoria")
+
+def _load_synonyms() -> Dict[str, List[str]]:
+    """Default synonyms, extended by the JSON file in VOLUMIO_SYNONYMS if set"""
+    synonyms = {name: list(words) for name, words in CATEGORY_SYNONYMS.items()}
+    path = os.getenv('VOLUMIO_SYNONYMS')
+    if path:
+        try:
+            with open(path, encoding="utf-8") as f:
+                for name, words in json.load(f).items():
+                    synonyms.setdefault(name, []).extend(words)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load synonyms from {path}: {e}")
+    return synonyms
+
+KEYWORD_INDEX = KeywordIndex(MUSIC_CATEGORIES, _load_synonyms())
+
+# Seed utterances for the local classifier, on top of category descriptions and synonyms
+SEED_EXAMPLES = {
+                "Running": ["vado a fare una corsa", "sto per allenarmi", "mi serve energia per lo sport",
+                            "voglio spingere al massimo in palestra", "faccio jogging al parco"],
+                "Kitchen": ["preparo la cena per gli amici", "sto cucinando la pasta",
+                            "abbiamo ospiti stasera", "aperitivo in casa con amici", "preparo il pranzo"],
+                "Ambient": ["voglio un sottofondo atmosferico", "qualcosa di elettronico e avvolgente",
+                            "musica spaziale e sognante", "mi serve un'atmosfera rarefatta"],
+                "Relaxing": ["ho avuto una giornata stressante", "voglio rilassarmi sul divano",
+                             "sono stanco e nervoso", "devo calmarmi prima di dormire",
+                             "ho bisogno di pace e tranquillità"],
+                "Working": ["devo concentrarmi sul lavoro", "sto studiando per un esame",
+                            "ho una scadenza e devo essere produttivo", "scrivo codice tutto il giorno"],
+                "Walking": ["faccio una passeggiata in città", "esco a camminare con il cane",
+                            "camminata in montagna", "passeggio lungo il mare"]
+                }
+
+class MoodClassifier:
+    """Nearest-centroid TF-IDF classifier over hashed word stems and character trigrams.
+
+    Centroids are running sums, so the model can be updated one example at a time.
+    """
+    def __init__(self, categories: Dict[str, MusicCategory], dim: int = 2 ** 14,
+                 temperature: float = 0.05):
+        self.categories = categories
+        self.labels = list(categories)
+        self.dim = dim
+        self.temperature = temperature
+        self._sums = np.zeros((len(self.labels), dim), dtype=np.float32)
+        self._doc_freq = np.zeros(dim, dtype=np.float32)
+        self._docs = 0
+        self._lock = threading.Lock()
+
+    def _features(self, text: str) -> np.ndarray:
+        """L2-normalized term-frequency vector of a text"""
+        normalized = normalize_text(text)
+        terms = [f"w:{_stem(t)}" for t in normalized.split()]
+        terms += [f"c:{gram}" for gram in _text_vector(normalized)]
+        vector = np.zeros(self.dim, dtype=np.float32)
+        if terms:
+            indices = [zlib.crc32(term.encode("utf-8")) % self.dim for term in terms]
+            np.add.at(vector, indices, 1.0)
+            np.log1p(vector, out=vector)
+            vector /= np.linalg.norm(vector)
+        return vector
+
+    def update(self, text: str, label: str):
+        """Add one labelled example"""
+        if label not in self.categories:
+            return
+        vector = self._features(text)
+        with self._lock:
+            self._sums[self.labels.index(label)] += vector
+            self._doc_freq += vector > 0
+            self._docs += 1
+
+    def fit(self, texts: Iterable[str], labels: Iterable[str]) -> "MoodClassifier":
+        for text, label in zip(texts, labels):
+            self.update(text, label)
+        return self
+
+    def predict(self, text: str) -> Tuple[Optional[str], float]:
+        """Most likely category and its confidence (softmax over centroid similarities)"""
+        vector = self._features(text)
+        if not vector.any() or self._docs == 0:
+            return None, 0.0
+        with self._lock:
+            idf = np.log((1 + self._docs) / (1 + self._doc_freq)) + 1
+            centroids = self._sums * idf
+        centroids /= np.maximum(np.linalg.norm(centroids, axis=1, keepdims=True), 1e-9)
+        query = vector * idf
+        similarities = centroids @ (query / np.linalg.norm(query))
+        weights = np.exp((similarities - similarities.max()) / self.temperature)
+        best = int(similarities.argmax())
+        return self.labels[best], float(weights[best] / weights.sum())
+
+    def classify(self, text: str, threshold: float) -> Optional[Dict[str, Any]]:
+        """Analysis result if the prediction is confident enough, None otherwise"""
+        label, confidence = self.predict(text)
+        if label is None or confidence < threshold:
+            return None
+        result = category_result(self.categories[label], "Classificatore locale")
+        result["confidenza"] = round(confidence, 3)
+        return result
+
+    @classmethod
+    def seeded(cls, categories: Dict[str, MusicCategory]) -> "MoodClassifier":
+        """Classifier trained on category descriptions, synonyms and seed examples"""
+        classifier = cls(categories)
+        for name, cat in categories.items():
+            examples = [f"{cat.name} {cat.description}"] + SEED_EXAMPLES.get(name, [])
+            examples += CATEGORY_SYNONYMS.get(name, [])
+            classifier.fit(examples, [name] * len(examples))
+        return classifier
+
+class AgreementMonitor:
+    """Measures how often the local classifier agrees with the model and sets its threshold.
+
+    The threshold is the lowest confidence above which recent predictions
+    matched the model at least ``target`` of the time, so the local path
+    answers more inputs as the classifier improves.
+    """
+    def __init__(self, default_threshold: float, target: float = 0.9,
+                 window: int = 500, min_samples: int = 30):
+        self.default_threshold = default_threshold
+        self.target = target
+        self.min_samples = min_samples
+        self.local_answers = 0
+        self.remote_answers = 0
+        self._samples: Deque[Tuple[float, bool]] = deque(maxlen=window)
+        self._threshold: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def record(self, confidence: float, agreed: bool):
+        with self._lock:
+            self._samples.append((confidence, agreed))
+            self._threshold = None
+
+    def count(self, local: bool):
+        with self._lock:
+            if local:
+                self.local_answers += 1
+            else:
+                self.remote_answers += 1
+
+    def threshold(self) -> float:
+        with self._lock:
+            if self._threshold is None:
+                self._threshold = self._calibrate()
+            return self._threshold
+
+    def _calibrate(self) -> float:
+        if len(self._samples) < self.min_samples:
+            return self.default_threshold
+        threshold, agreed = float("inf"), 0
+        for i, (confidence, ok) in enumerate(sorted(self._samples, reverse=True), 1):
+            agreed += ok
+            if i >= self.min_samples and agreed / i >= self.target:
+                threshold = confidence
+        return threshold
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            samples = list(self._samples)
+            answers = self.local_answers + self.remote_answers
+        threshold = self.threshold()
+        return {"campioni": len(samples),
+                "accordo": round(sum(ok for _, ok in samples) / len(samples), 3) if samples else None,
+                "soglia": round(threshold, 3) if threshold != float("inf") else None,
+                "quota_locale": round(self.local_answers / answers, 3) if answers else 0.0}
+
+# Starting confidence for the local classifier to answer without the model, until
+# enough agreement samples (VOLUMIO_CLASSIFIER_TARGET precision) are collected
+CLASSIFIER_THRESHOLD = float(os.getenv('VOLUMIO_CLASSIFIER_THRESHOLD', '0.6'))
+CLASSIFIER_TARGET = float(os.getenv('VOLUMIO_CLASSIFIER_TARGET', '0.9'))
+# Share of local answers also sent to the model in the background to measure agreement
+CLASSIFIER_AUDIT_RATE = float(os.getenv('VOLUMIO_CLASSIFIER_AUDIT_RATE', '0.05'))
+
+def _load_classifier() -> Tuple[MoodClassifier, AgreementMonitor]:
+    """Seeded classifier, further trained on the model labels stored by earlier runs"""
+    classifier = MoodClassifier.seeded(MUSIC_CATEGORIES)
+    agreement = AgreementMonitor(CLASSIFIER_THRESHOLD, CLASSIFIER_TARGET)
+    if PERSISTENT_CACHE is not None:
+        for text, label, predicted, confidence in PERSISTENT_CACHE.examples():
+            classifier.update(text, label)
+            agreement.record(confidence, predicted == label)
+    return classifier, agreement
+
+MOOD_CLASSIFIER, CLASSIFIER_AGREEMENT = RESOURCES.get("classifier", _load_classifier)
+
+class SpeechBackend(ABC):
+    """Speech-to-text engine interface.
+
+    ``transcribe`` raises ``sr.UnknownValueError`` when nothing was understood and
+    ``sr.RequestError`` when the engine itself fails.
+    """
+    name = "base"
+    remote = False
+
+    @abstractmethod
+    def transcribe(self, audio: sr.AudioData) -> str:
+        """Transcribe a 16 kHz mono 16-bit clip"""
+
+    def create_stream(self) -> "RecognitionStream":
+        """Incremental recognition; engines without it transcribe the buffered audio at the end"""
+        return BufferedRecognitionStream(self)
+
+class RecognitionStream(ABC):
+    """Incremental recognition of 16 kHz mono 16-bit frames"""
+    @abstractmethod
+    def accept(self, frame: bytes) -> str:
+        """Consume one frame and return the partial transcript so far"""
+
+    @abstractmethod
+    def finish(self) -> str:
+        """Return the final transcript, raising like ``SpeechBackend.transcribe``"""
+
+class BufferedRecognitionStream(RecognitionStream):
+    """Collects frames and runs one batch transcription on finish"""
+    def __init__(self, backend: SpeechBackend):
+        self.backend = backend
+        self._frames: List[bytes] = []
+
+    def accept(self, frame: bytes) -> str:
+        self._frames.append(frame)
+        return ""
+
+    def finish(self) -> str:
+        return self.backend.transcribe(sr.AudioData(b"".join(self._frames), STT_SAMPLE_RATE, 2))
+
+class GoogleSpeechBackend(SpeechBackend):
+    """Google Web Speech API (remote)"""
+    name = "google"
+    remote = True
+
+    def __init__(self, recognizer: sr.Recognizer, language: str = "it-IT"):
+        self.recognizer = recognizer
+        self.language = language
+
+    def transcribe(self, audio: sr.AudioData) -> str:
+        return self.recognizer.recognize_google(audio, language=self.language)
+
+class VoskSpeechBackend(SpeechBackend):
+    """Offline Vosk/Kaldi recognition (requires the ``vosk`` package and a model directory)"""
+    name = "vosk"
+    sample_rate = 16000
+
+    def __init__(self, model_path: str):
+        import vosk
+        vosk.SetLogLevel(-1)
+        self._vosk = vosk
+        self.model = vosk.Model(model_path)
+
+    def transcribe(self, audio: sr.AudioData) -> str:
+        recognizer = self._vosk.KaldiRecognizer(self.model, self.sample_rate)
+        recognizer.AcceptWaveform(audio.get_raw_data(convert_rate=self.sample_rate, convert_width=2))
+        text = json.loads(recognizer.FinalResult()).get("text", "")
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+    def create_stream(self) -> RecognitionStream:
+        return VoskRecognitionStream(self._vosk.KaldiRecognizer(self.model, self.sample_rate))
+
+class VoskRecognitionStream(RecognitionStream):
+    """Native Vosk incremental decoding"""
+    def __init__(self, recognizer):
+        self.recognizer = recognizer
+        self._segments: List[str] = []
+
+    def accept(self, frame: bytes) -> str:
+        if self.recognizer.AcceptWaveform(frame):
+            # A segment was finalized at an internal pause
+            self._segments.append(json.loads(self.recognizer.Result()).get("text", ""))
+            partial = ""
+        else:
+            partial = json.loads(self.recognizer.PartialResult()).get("partial", "")
+        return " ".join(s for s in self._segments + [partial] if s)
+
+    def finish(self) -> str:
+        self._segments.append(json.loads(self.recognizer.FinalResult()).get("text", ""))
+        text = " ".join(s for s in self._segments if s)
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+class WhisperCppSpeechBackend(SpeechBackend):
+    """Offline whisper.cpp recognition (requires the ``pywhispercpp`` package)"""
+    name = "whisper_cpp"
+    sample_rate = 16000
+
+    def __init__(self, model: str = "base", language: str = "it"):
+        from pywhispercpp.model import Model
+        self.model = Model(model, language=language, print_progress=False)
+
+    def transcribe(self, audio: sr.AudioData) -> str:
+        pcm = audio.get_raw_data(convert_rate=self.sample_rate, convert_width=2)
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        text = " ".join(segment.text for segment in self.model.transcribe(samples)).strip()
+        if not text:
+            raise sr.UnknownValueError()
+        return text
+
+class StubSpeechBackend(SpeechBackend):
+    """Deterministic backend for tests and benchmarks"""
+    name = "stub"
+
+    def __init__(self, transcript: str = "voglio rilassarmi"):
+        self.transcript = transcript
+
+    def transcribe(self, audio: sr.AudioData) -> str:
+        if not self.transcript:
+            raise sr.UnknownValueError()
+        return self.transcript
+
+def create_speech_backend(name: str, recognizer: sr.Recognizer,
+                          model: Optional[str] = None) -> SpeechBackend:
+    """Build the configured backend, falling back to Google if it is unavailable"""
+    try:
+        if name == "vosk":
+            return VoskSpeechBackend(model or "model")
+        if name == "whisper_cpp":
+            return WhisperCppSpeechBackend(model or "base")
+        if name == "stub":
+            return StubSpeechBackend()
+        if name != "google":
+            logger.error(f"Unknown speech backend '{name}', using google")
+    except Exception as e:
+        logger.error(f"Could not initialize speech backend '{name}', using google: {e}")
+    return GoogleSpeechBackend(recognizer)
+
+class VoiceActivityDetector:
+    """Energy-based voice activity detection on fixed-size frames"""
+    def __init__(self, frame_ms: int = 20, min_rms: float = 0.01,
+                 noise_factor: float = 3.0, padding_ms: int = 200, max_peak_ratio: float = 0.5):
+        self.frame_ms = frame_ms
+        self.min_rms = min_rms  # ~ -40 dBFS
+        self.noise_factor = noise_factor
+        self.padding_ms = padding_ms
+        self.max_peak_ratio = max_peak_ratio
+
+    def voiced_range(self, samples: np.ndarray, sample_rate: int,
+                     full_scale: float = 1.0) -> Optional[Tuple[int, int]]:
+        """Return the (start, end) sample range containing speech, or None if silent.
+
+        ``samples`` has shape (n_samples, n_channels); ``full_scale`` is the amplitude of a
+        full-scale sample (1.0 for float audio, 32768 for 16-bit PCM).
+        """
+        frame_len = max(1, sample_rate * self.frame_ms // 1000)
+        n_frames = len(samples) // frame_len
+        if n_frames == 0:
+            return None
+        mono = samples[:n_frames * frame_len].mean(axis=1, dtype=np.float32) / full_scale
+        rms = np.sqrt(np.mean(mono.reshape(n_frames, frame_len) ** 2, axis=1))
+        # The quietest frames estimate the noise floor, unless the clip has no pauses:
+        # then the estimate approaches the loudest frames and is not used
+        adaptive = np.percentile(rms, 10) * self.noise_factor
+        threshold = adaptive if self.min_rms < adaptive <= self.max_peak_ratio * rms.max() else self.min_rms
+        voiced = np.flatnonzero(rms > threshold)
+        if voiced.size == 0:
+            return None
+        padding = sample_rate * self.padding_ms // 1000
+        start = max(0, voiced[0] * frame_len - padding)
+        end = min(len(samples), (voiced[-1] + 1) * frame_len + padding)
+        return start, end
+
+@lru_cache(maxsize=8)
+def _lowpass_taps(cutoff: float, num_taps: int = 63) -> np.ndarray:
+    """Hamming-windowed sinc low-pass filter; ``cutoff`` is a fraction of the sample rate"""
+    n = np.arange(num_taps) - (num_taps - 1) / 2
+    taps = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(num_taps)
+    return (taps / taps.sum()).astype(np.float32)
+
+def to_stt_format(pcm: np.ndarray, sample_rate: int, full_scale: float) -> Tuple[np.ndarray, int]:
+    """Downmix to mono, resample to at most STT_SAMPLE_RATE and convert to 16-bit.
+
+    ``pcm`` has shape (n_samples, n_channels). Returns the int16 samples and their rate.
+    """
+    mono = pcm.mean(axis=1, dtype=np.float32) if pcm.shape[1] > 1 else pcm[:, 0].astype(np.float32)
+    mono *= 32768.0 / full_scale
+    if sample_rate > STT_SAMPLE_RATE and mono.size:
+        # Anti-alias below the new Nyquist frequency, then interpolate at the new sample times
+        mono = np.convolve(mono, _lowpass_taps(0.45 * STT_SAMPLE_RATE / sample_rate), mode="same")
+        n_out = int(mono.size * STT_SAMPLE_RATE / sample_rate)
+        positions = np.arange(n_out, dtype=np.float64) * (sample_rate / STT_SAMPLE_RATE)
+        mono = np.interp(positions, np.arange(mono.size), mono)
+        sample_rate = STT_SAMPLE_RATE
+    return np.clip(np.rint(mono), -32768, 32767).astype("<i2"), sample_rate
+
+class StreamingResampler:
+    """Chunked equivalent of ``to_stt_format`` for live capture.
+
+    The filter history and the position of the next output sample carry over
+    between chunks, so chunk boundaries leave no edge artifacts.
+    """
+    def __init__(self, sample_rate: int, full_scale: float = 32768.0, num_taps: int = 63):
+        self.sample_rate = sample_rate
+        self.full_scale = full_scale
+        self.step = sample_rate / STT_SAMPLE_RATE
+        self.taps = _lowpass_taps(0.45 / self.step, num_taps) if self.step > 1 else None
+        # Output sample k sits at filtered index k * step + delay
+        self._delay = (num_taps - 1) / 2
+        self._history = np.zeros(num_taps - 1, dtype=np.float32)
+        self._last = np.zeros(0, dtype=np.float32)
+        self._filtered = 0
+        self._emitted = 0
+
+    def process(self, pcm: np.ndarray) -> np.ndarray:
+        """Convert a chunk of shape (n_samples, n_channels) to int16 at the STT rate"""
+        mono = pcm.mean(axis=1, dtype=np.float32) if pcm.shape[1] > 1 else pcm[:, 0].astype(np.float32)
+        mono *= 32768.0 / self.full_scale
+        if self.taps is not None and mono.size:
+            signal = np.concatenate([self._history, mono])
+            self._history = signal[-self._history.size:]
+            filtered = np.convolve(signal, self.taps, mode="valid")
+            # One filtered sample from the previous chunk to interpolate across the boundary
+            window = np.concatenate([self._last, filtered])
+            base = self._filtered - self._last.size
+            self._filtered += filtered.size
+            self._last = filtered[-1:]
+            n_out = int((self._filtered - 1 - self._delay) // self.step) + 1 - self._emitted
+            positions = (self._emitted + np.arange(max(0, n_out))) * self.step + self._delay
+            self._emitted += max(0, n_out)
+            mono = np.interp(positions - base, np.arange(window.size), window)
+        elif self.taps is not None:
+            mono = np.zeros(0, dtype=np.float32)
+        return np.clip(np.rint(mono), -32768, 32767).astype("<i2")
+
+@dataclass
+class PcmBuffer:
+    """PCM frames of a WAV clip, viewed in place without copying"""
+    sample_rate: int
+    sample_width: int
+    channels: int
+    frames: memoryview
+
+    @property
+    def full_scale(self) -> float:
+        return float(2 ** (8 * self.sample_width - 1))
+
+    def samples(self) -> np.ndarray:
+        """Signed samples of shape (n_samples, n_channels); a view except for 8-bit audio"""
+        if self.sample_width == 1:
+            # 8-bit WAV is unsigned, AudioData expects signed samples
+            pcm = (np.frombuffer(self.frames, dtype=np.uint8) ^ 0x80).view(np.int8)
+        else:
+            pcm = np.frombuffer(self.frames, dtype=f"<i{self.sample_width}")
+        return pcm.reshape(-1, self.channels)
+
+def parse_wav(data: bytes) -> Optional[PcmBuffer]:
+    """Parse the RIFF header of an integer PCM WAV clip; None for any other format"""
+    if len(data) < 12 or data[0:4] != b"RIFF" or data[8:12] != b"WAVE":
+        return None
+    view = memoryview(data)
+    fmt = None
+    pos = 12
+    while pos + 8 <= len(data):
+        chunk_id = data[pos:pos + 4]
+        size = struct.unpack_from("<I", data, pos + 4)[0]
+        body = pos + 8
+        if chunk_id == b"fmt " and size >= 16:
+            tag, channels, sample_rate, _, _, bits = struct.unpack_from("<HHIIHH", data, body)
+            if tag == 0xFFFE and size >= 40:
+                # WAVE_FORMAT_EXTENSIBLE: the real format is in the sub-format GUID
+                tag = struct.unpack_from("<H", data, body + 24)[0]
+            fmt = (tag, channels, sample_rate, bits)
+        elif chunk_id == b"data":
+            if fmt is None or fmt[0] != 1 or fmt[3] not in (8, 16, 32) or fmt[1] == 0:
+                return None
+            _, channels, sample_rate, bits = fmt
+            frame_size = channels * bits // 8
+            # Streaming recorders may leave the size unset: clamp to the actual data
+            end = min(len(data), body + size)
+            end -= (end - body) % frame_size
+            return PcmBuffer(sample_rate, bits // 8, channels, view[body:end])
+        pos = body + size + (size & 1)
+    return None
+
+def _create_recognizer() -> sr.Recognizer:
+    recognizer = sr.Recognizer()
+    # Adjust recognition parameters for better accuracy
+    recognizer.energy_threshold = 300
+    recognizer.dynamic_energy_threshold = True
+    recognizer.pause_threshold = 0.8
+    return recognizer
+
 class AudioProcessor:
     """Enhanced audio processing and voice recognition"""
-    def __init__(self):
-        self.recognizer = sr.Recognizer()
-        # Adjust recognition parameters for better accuracy
-        self.recognizer.energy_threshold = 300
-        self.recognizer.dynamic_energy_threshold = True
-        self.recognizer.pause_threshold = 0.8
+    def __init__(self, backend: Optional[SpeechBackend] = None):
+        # Shared: local speech models are too slow to load on every rerun
+        self.recognizer = RESOURCES.get("recognizer", _create_recognizer)
+        self.backend = backend or RESOURCES.get(
+            "speech_backend", lambda: create_speech_backend(STT_BACKEND, self.recognizer, STT_MODEL))
+        self.vad = VoiceActivityDetector()
 
     @staticmethod
     def _prepare_audio_file(audio_bytes: bytes) -> io.BytesIO:
@@ -53,14 +1499,55 @@ class AudioProcessor:
         audio_file.seek(0)  # Reset file pointer
         return audio_file
 
+    def _load_audio(self, audio_bytes: bytes) -> Optional[sr.AudioData]:
+        """Decode the clip and trim silence; None if it contains no speech"""
+        with TRACER.span("audio_decode"):
+            buffer = parse_wav(audio_bytes)
+        if buffer is None:
+            # Not a plain PCM WAV: let speech_recognition decode it, without trimming
+            with TRACER.span("audio_decode"), sr.AudioFile(self._prepare_audio_file(audio_bytes)) as source:
+                return self.recognizer.record(source)
+
+        pcm = buffer.samples()
+        with TRACER.span("vad"):
+            voiced = self.vad.voiced_range(pcm, buffer.sample_rate, buffer.full_scale)
+        if voiced is None:
+            return None
+        start, end = voiced
+        with TRACER.span("resample"):
+            pcm, sample_rate = to_stt_format(pcm[start:end], buffer.sample_rate, buffer.full_scale)
+        return sr.AudioData(pcm.tobytes(), sample_rate, 2)
+
     def process(self, audio_bytes: bytes) -> Tuple[str, bool]:
         """Process audio and return transcribed text with success status"""
         try:
-            audio_file = self._prepare_audio_file(audio_bytes)
-            with sr.AudioFile(audio_file) as source:
-                audio = self.recognizer.record(source)
-                text = self.recognizer.recognize_google(audio, language="it-IT")
-                return text.lower(), True
+            audio = self._load_audio(audio_bytes)
+        except Exception as e:
+            logger.error(f"Unexpected error in audio processing: {e}")
+            return f"Errore imprevisto: {str(e)}", False
+        if audio is None:
+            logger.info("No speech detected, skipping recognition")
+            return "Nessun parlato rilevato, per favore riprova.", False
+        return self._recognize(self.backend.transcribe, audio)
+
+    def create_stream(self) -> "StreamingTranscriber":
+        """Start an incremental transcription fed with live audio frames"""
+        return StreamingTranscriber(self, self.backend.create_stream(), self.vad.min_rms)
+
+    def _recognize(self, transcribe: Callable[..., str], *args) -> Tuple[str, bool]:
+        """Run a recognition call and map its failures to user messages"""
+        try:
+            with TRACER.span("stt", backend=self.backend.name):
+                if self.backend.remote:
+                    # Not understanding the audio is not a service failure
+                    text = SPEECH_GUARD.call(transcribe, *args,
+                                             is_failure=lambda e: not isinstance(e, sr.UnknownValueError))
+                else:
+                    text = transcribe(*args)
+            return text.lower(), True
+        except RemoteUnavailableError as e:
+            logger.warning(f"Speech recognition unavailable: {e}")
+            return "Servizio di riconoscimento vocale temporaneamente non disponibile.", False
         except sr.UnknownValueError:
             logger.warning("Speech recognition could not understand audio")
             return "Audio non chiaro, per favore riprova.", False
@@ -71,16 +1558,165 @@ class AudioProcessor:
             logger.error(f"Unexpected error in audio processing: {e}")
             return f"Errore imprevisto: {str(e)}", False
 
-class EmotionalAnalyzer:
-    """Enhanced emotional analysis with Gemini"""
-    
-    @staticmethod
-    def _create_analysis_prompt(text: str) -> str:
-        """Create the analysis prompt with optimized formatting"""
-        return f"""Analizza il testo utente e genera una raccomandazione musicale in formato JSON. 
+    def process_many(self, clips: Iterable[bytes],
+                     max_workers: int = 4) -> Tuple[List[Tuple[str, bool]], Dict[str, Any]]:
+        """Process several clips concurrently.
+
+        Results keep the input order; each item carries its own success status.
+        """
+        start_time = time.time()
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stt") as executor:
+            results = list(executor.map(self.process, clips))
+        elapsed = time.time() - start_time
+        succeeded = sum(1 for _, success in results if success)
+        return results, {
+            "clips": len(results),
+            "succeeded": succeeded,
+            "failed": len(results) - succeeded,
+            "elapsed_ms": round(elapsed * 1000),
+            "clips_per_s": round(len(results) / elapsed, 2) if elapsed else 0.0
+        }
+
+class StreamingTranscriber:
+    """Feeds live audio in fixed-size frames to an incremental recognizer and detects end of speech"""
+    def __init__(self, processor: "AudioProcessor", stream: "RecognitionStream", min_rms: float,
+                 frame_ms: int = 30, end_silence_ms: int = 700):
+        self.processor = processor
+        self.stream = stream
+        self.min_rms = min_rms * 32768.0
+        self.frame_len = STT_SAMPLE_RATE * frame_ms // 1000
+        self.frame_ms = frame_ms
+        self.end_silence_ms = end_silence_ms
+        self.partial = ""
+        self.speech_started = False
+        self.ended = False
+        self._pending = np.zeros(0, dtype="<i2")
+        self._silence_ms = 0
+        self._resampler: Optional[StreamingResampler] = None
+
+    def feed(self, pcm: np.ndarray, sample_rate: int, full_scale: float = 32768.0) -> str:
+        """Add captured samples of shape (n_samples, n_channels); returns the current partial transcript"""
+        if self.ended:
+            return self.partial
+        if (self._resampler is None or self._resampler.sample_rate != sample_rate
+                or self._resampler.full_scale != full_scale):
+            self._resampler = StreamingResampler(sample_rate, full_scale)
+        samples = self._resampler.process(pcm)
+        self._pending = np.concatenate([self._pending, samples])
+        n_frames = len(self._pending) // self.frame_len
+        frames = self._pending[:n_frames * self.frame_len].reshape(n_frames, self.frame_len)
+        self._pending = self._pending[n_frames * self.frame_len:]
+        rms = np.sqrt(np.mean(frames.astype(np.float32) ** 2, axis=1))
+        for frame, voiced in zip(frames, rms > self.min_rms):
+            if voiced:
+                self.speech_started = True
+                self._silence_ms = 0
+            elif not self.speech_started:
+                continue  # Leading silence is never sent to the recognizer
+            else:
+                self._silence_ms += self.frame_ms
+            self.partial = self.stream.accept(frame.tobytes()) or self.partial
+            if self._silence_ms >= self.end_silence_ms:
+                self.ended = True
+                break
+        return self.partial
+
+    def finish(self) -> Tuple[str, bool]:
+        """Final transcript with success status, as returned by ``AudioProcessor.process``"""
+        if not self.speech_started:
+            return "Nessun parlato rilevato, per favore riprova.", False
+        return self.processor._recognize(self.stream.finish)
+
+class IncrementalJSONParser:
+    """Incremental parser emitting top-level JSON object fields as soon as they are complete"""
+    def __init__(self):
+        self._buffer = ""
+        self._pos = 0
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key: Optional[str] = None
+        self._token_start: Optional[int] = None
+        self.fields: Dict[str, Any] = {}
+        self.complete = False
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk and return the (key, value) pairs completed by it"""
+        self._buffer += chunk
+        completed = []
+        while self._pos < len(self._buffer) and not self.complete:
+            char = self._buffer[self._pos]
+            if self._depth == 0:
+                # Text around the object (e.g. a code fence) is skipped
+                if char == "{":
+                    self._depth = 1
+            elif self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._key is None:
+                        # End of a top-level key
+                        self._key = json.loads(self._buffer[self._token_start:self._pos + 1])
+                        self._token_start = None
+            elif char == '"':
+                self._in_string = True
+                if self._depth == 1 and self._token_start is None:
+                    self._token_start = self._pos
+            elif char in "{[":
+                self._depth += 1
+                if self._depth == 2 and self._token_start is None:
+                    self._token_start = self._pos
+            elif char in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._emit(completed)
+                    self.complete = True
+            elif char == ":" and self._depth == 1:
+                self._token_start = self._pos + 1
+            elif char == "," and self._depth == 1:
+                self._emit(completed)
+            self._pos += 1
+        return completed
+
+    def _emit(self, completed: List[Tuple[str, Any]]):
+        """Decode the pending value of the current key, if any"""
+        if self._key is not None and self._token_start is not None:
+            value = json.loads(self._buffer[self._token_start:self._pos])
+            self.fields[self._key] = value
+            completed.append((self._key, value))
+        self._key = None
+        self._token_start = None
+
+class PromptTemplates:
+    """Analysis prompts with a static prefix compiled once per category table.
+
+    The prefix is rebuilt only when the categories change, and ``version``
+    identifies it (e.g. as part of cache keys).
+    """
+    def __init__(self, categories: Dict[str, MusicCategory]):
+        self.categories = categories
+        self._fingerprint: Optional[Tuple] = None
+        self._lock = threading.Lock()
+        self._version = ""
+        self._table = ""
+        self._analysis_prefix = ""
+        self._batch_prefix = ""
+
+    def _refresh(self):
+        """Recompile the prefixes if the category table changed"""
+        fingerprint = tuple((c.name, c.bpm_range, c.description) for c in self.categories.values())
+        if fingerprint == self._fingerprint:
+            return
+        with self._lock:
+            table = "\n".join(f"{name}: ({bpm} BPM) {description}" for name, bpm, description in fingerprint)
+            self._table = table
+            self._analysis_prefix = f"""Analizza il testo utente e genera una raccomandazione musicale in formato JSON. 
         Usa SOLO una di queste categorie con le relative caratteristiche:
 
-        {EmotionalAnalyzer._format_categories()}
+        {table}
 
         Struttura JSON richiesta:
         {{
@@ -92,48 +1728,323 @@ class EmotionalAnalyzer:
             "reasoning": "spiegazione tecnica della scelta (max 20 parole)"
         }}
 
-        Analizza ora questo input: {text}"""
+        Analizza ora questo input: """
+            self._batch_prefix = f"""Analizza ciascun testo utente e genera una raccomandazione musicale per ognuno.
+        Usa SOLO una di queste categorie con le relative caratteristiche:
+
+        {table}
+
+        Rispondi con un array JSON con un oggetto per input, nella stessa struttura:
+        [
+            {{
+                "indice": numero dell'input,
+                "flow_consigliato": "nome categoria",
+                "bpm_range": "range BPM",
+                "caratteristiche": ["caratteristica1", "caratteristica2"],
+                "esempi_genere": ["genere1", "genere2"],
+                "percezione_emotiva": "breve descrizione emozione rilevata (max 10 parole)",
+                "reasoning": "spiegazione tecnica della scelta (max 20 parole)"
+            }}
+        ]
+
+        Analizza ora questi input:
+        """
+            self._version = hashlib.sha1(
+                (self._analysis_prefix + self._batch_prefix).encode("utf-8")).hexdigest()[:8]
+            self._fingerprint = fingerprint
+
+    @property
+    def version(self) -> str:
+        self._refresh()
+        return self._version
+
+    def categories_table(self) -> str:
+        self._refresh()
+        return self._table
+
+    def analysis(self, text: str) -> str:
+        self._refresh()
+        return self._analysis_prefix + text
+
+    def batch(self, texts: List[str]) -> str:
+        self._refresh()
+        return self._batch_prefix + "\n".join(
+            f"{i}: {json.dumps(text, ensure_ascii=False)}" for i, text in enumerate(texts))
+
+PROMPT_TEMPLATES = PromptTemplates(MUSIC_CATEGORIES)
+PROMPT_TEMPLATES.categories_table()  # Compile at import
+
+# Hard upper bound on analysis time; 0 disables it
+ANALYSIS_DEADLINE_S = float(os.getenv('VOLUMIO_ANALYSIS_DEADLINE_S', '3.0'))
+ANALYSIS_EXECUTOR = RESOURCES.get(
+    "analysis_executor", lambda: ThreadPoolExecutor(max_workers=8, thread_name_prefix="analysis"),
+    close=_shutdown_executor)
+
+def _submit_in_context(executor: ThreadPoolExecutor, func, *args) -> Future:
+    """Submit a call carrying over context variables and the Streamlit script context"""
+    ctx = get_script_run_ctx()
+    context = contextvars.copy_context()
+
+    def _call():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return context.run(func, *args)
+
+    return executor.submit(_call)
+
+# Fields every analysis result must contain
+RESULT_FIELDS = ("flow_consigliato", "bpm_range", "caratteristiche",
+                 "esempi_genere", "percezione_emotiva", "reasoning")
+
+class EmotionalAnalyzer:
+    """Enhanced emotional analysis with Gemini"""
+    def __init__(self, cache: Optional[SemanticCache] = None,
+                 keyword_index: Optional[KeywordIndex] = None,
+                 hedging: Optional[HedgingPolicy] = None,
+                 deadline_s: Optional[float] = ANALYSIS_DEADLINE_S,
+                 persistent_cache: Optional[PersistentCache] = None,
+                 classifier: Optional[MoodClassifier] = None,
+                 agreement: Optional[AgreementMonitor] = None,
+                 audit_rate: float = CLASSIFIER_AUDIT_RATE):
+        # Shared across dashboard instances, which are rebuilt on every rerun
+        self.cache = cache if cache is not None else ANALYSIS_CACHE
+        self.persistent_cache = persistent_cache if persistent_cache is not None else PERSISTENT_CACHE
+        self.keyword_index = keyword_index if keyword_index is not None else KEYWORD_INDEX
+        self.classifier = classifier if classifier is not None else MOOD_CLASSIFIER
+        self.agreement = agreement if agreement is not None else CLASSIFIER_AGREEMENT
+        self.audit_rate = audit_rate
+        self.hedging = hedging if hedging is not None else HEDGING_POLICY
+        self.deadline_s = deadline_s
+        self.last_result: Optional[Dict[str, Any]] = None
+
+    @staticmethod
+    def _create_analysis_prompt(text: str) -> str:
+        """Create the analysis prompt from the precompiled prefix"""
+        return PROMPT_TEMPLATES.analysis(text)
+
+    @staticmethod
+    def _create_batch_prompt(texts: List[str]) -> str:
+        """Create a single prompt analyzing several inputs at once"""
+        return PROMPT_TEMPLATES.batch(texts)
 
     @staticmethod
     def _format_categories() -> str:
         """Format music categories for the prompt"""
-        return "\n".join(
-            f"{cat.name}: ({cat.bpm_range} BPM) {cat.description}"
-            for cat in MUSIC_CATEGORIES.values()
-        )
+        return PROMPT_TEMPLATES.categories_table()
 
     @staticmethod
     def _clean_response(response: str) -> str:
         """Clean the API response"""
         return response.replace('```json', '').replace('```', '').strip()
 
-    def analyze(self, text: str) -> Dict[str, Any]:
-        """Analyze text and return music recommendations"""
+    @staticmethod
+    def _is_complete(result: Any) -> bool:
+        """Whether a parsed response is an analysis with every expected field"""
+        return isinstance(result, dict) and all(field in result for field in RESULT_FIELDS)
+
+    def _lookup(self, text: str) -> Optional[Dict[str, Any]]:
+        """Cached analysis: in-memory similarity cache first, then the shared on-disk cache"""
+        result = self.cache.get(text)
+        if result is None and self.persistent_cache is not None:
+            result = self.persistent_cache.get(text, PROMPT_TEMPLATES.version)
+            if result is not None:
+                self.cache.put(text, result)
+        return result
+
+    def _local(self, text: str) -> Optional[Dict[str, Any]]:
+        """Answer without the model: keywords, then the caches, then a confident local classifier"""
+        result = self.keyword_index.classify(text) or self._lookup(text)
+        if result is None:
+            # Negations are lost on a bag of words: like the keyword tier, leave them to the model
+            if not NEGATIONS.intersection(normalize_text(text).split()):
+                result = self.classifier.classify(text, self.agreement.threshold())
+            self.agreement.count(local=result is not None)
+            if result is not None and random.random() < self.audit_rate:
+                # Background check against the model keeps the agreement estimate honest
+                _submit_in_context(ANALYSIS_EXECUTOR, self._analyze_remote, text, None, time.time())
+        return result
+
+    def _learn(self, text: str, result: Dict[str, Any]):
+        """Distill a model answer into the local classifier and record whether it agreed"""
+        label = result.get("flow_consigliato")
+        if label not in self.classifier.categories:
+            return
+        predicted, confidence = self.classifier.predict(text)
+        self.agreement.record(confidence, predicted == label)
+        self.classifier.update(text, label)
+        if self.persistent_cache is not None:
+            self.persistent_cache.add_example(text, label, predicted, confidence)
+
+    def _store(self, text: str, result: Dict[str, Any]):
+        self.cache.put(text, result)
+        if self.persistent_cache is not None:
+            self.persistent_cache.put(text, PROMPT_TEMPLATES.version, result)
+
+    def analyze(self, text: str,
+                on_field: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+        """Analyze text and return music recommendations.
+
+        Fields are passed to ``on_field`` as soon as they are complete in the stream.
+        """
         start_time = time.time()
+        # Obvious intents are answered locally, ambiguous ones go to the model
+        cached = self._local(text)
+        if cached is not None:
+            if on_field:
+                for key, value in cached.items():
+                    on_field(key, value)
+            cached['latenza_ms'] = round((time.time() - start_time) * 1000)
+            return cached
+
+        if not self.deadline_s:
+            return self._analyze_remote(text, on_field, start_time)
+
+        expired = threading.Event()
+
+        def guarded_on_field(key: str, value: Any):
+            # Late fields from a call that outlived its deadline are not shown
+            if on_field and not expired.is_set():
+                on_field(key, value)
+
+        future = _submit_in_context(ANALYSIS_EXECUTOR, self._analyze_remote,
+                                    text, guarded_on_field, start_time)
         try:
-            prompt = self._create_analysis_prompt(text)
-            response_placeholder = st.empty()
-            
-            # Non-async response generation
-            response = VOLUMIO_MODEL.generate_content(prompt)
-            if response and response.text:
-                cleaned_response = self._clean_response(response.text)
+            return future.result(timeout=max(0.0, self.deadline_s - (time.time() - start_time)))
+        except FutureTimeoutError:
+            # The call keeps running in the background and warms the cache when it completes
+            expired.set()
+            logger.warning(f"Analysis deadline of {self.deadline_s}s exceeded, using local fallback")
+            return self._create_degraded_response(text, start_time)
+
+    def _analyze_remote(self, text: str, on_field: Optional[Callable[[str, Any], None]],
+                        start_time: float) -> Dict[str, Any]:
+        """Analyze text with the model, caching successful results"""
+        try:
+            with TRACER.span("prompt_build"):
+                prompt = self._create_analysis_prompt(text)
+
+            parser = IncrementalJSONParser()
+            full_response = ""
+            parse_ms = 0.0
+            with TRACER.span("model_call"):
+                if self.hedging:
+                    stream = VOLUMIO_MODEL.generate_content_hedged(prompt, self.hedging)
+                else:
+                    stream = VOLUMIO_MODEL.generate_content(prompt, stream=True)
+                for chunk in stream:
+                    if not full_response:
+                        TRACER.record("time_to_first_token", (time.time() - start_time) * 1000)
+                    full_response += chunk.text
+                    parse_start = time.perf_counter()
+                    try:
+                        completed = parser.feed(chunk.text)
+                    except json.JSONDecodeError:
+                        completed = []
+                    parse_ms += (time.perf_counter() - parse_start) * 1000
+                    if on_field:
+                        for key, value in completed:
+                            on_field(key, value)
+
+            if not full_response:
+                logger.error("Empty response from model")
+                return self._create_error_response("Nessuna risposta dal modello", start_time)
+
+            parse_start = time.perf_counter()
+            if parser.complete and self._is_complete(parser.fields):
+                result = dict(parser.fields)
+            else:
                 try:
-                    result = json.loads(cleaned_response)
-                    # Aggiungi la latenza in millisecondi
-                    result['latenza_ms'] = round((time.time() - start_time) * 1000)
-                    return result
+                    result = json.loads(self._clean_response(full_response))
                 except json.JSONDecodeError:
+                    result = None
+                if not self._is_complete(result):
                     logger.error("Invalid JSON in response")
                     return self._create_error_response("Formato risposta non valido", start_time)
-            else:
-                logger.error("Empty response from model")
-                return self._create_error_response("Nessuna risposta dal modello", start_time)
+            TRACER.record("json_parse", parse_ms + (time.perf_counter() - parse_start) * 1000)
+            self._store(text, result)
+            self._learn(text, result)
+            self.last_result = dict(result)
+            # Aggiungi la latenza in millisecondi
+            result['latenza_ms'] = round((time.time() - start_time) * 1000)
+            return result
             
+        except RemoteUnavailableError as e:
+            logger.warning(f"Model unavailable: {e}")
+            return self._create_degraded_response(text, start_time, "Servizio temporaneamente non disponibile")
         except Exception as e:
             logger.error(f"Analysis error: {e}")
             return self._create_error_response(str(e), start_time)
 
+    def _create_degraded_response(self, text: str, start_time: float,
+                                  reason: str = "Tempo di risposta superato") -> Dict[str, Any]:
+        """Best-effort local answer: closest keyword category, else the classifier's best guess,
+        else the last known mood"""
+        name = self.keyword_index.best_match(text)
+        guess = self.classifier.classify(text, 0.0) if name is None else None
+        if name is not None:
+            result = self.keyword_index.classify_as(name)
+        elif guess is not None:
+            result = guess
+        elif self.last_result is not None:
+            result = dict(self.last_result)
+            result["reasoning"] = "Ultimo umore rilevato, analisi completa non disponibile in tempo"
+        else:
+            result = self._create_error_response(reason, start_time)
+        result["degradato"] = True
+        result["latenza_ms"] = round((time.time() - start_time) * 1000)
+        return result
+
+    def analyze_batch(self, texts: List[str], batch_size: int = 20) -> List[Dict[str, Any]]:
+        """Analyze several texts, packing the ones that need the model into shared requests.
+
+        Results keep the input order. Items missing or malformed in a batch
+        response are retried one by one, without the interactive deadline.
+        """
+        results: List[Optional[Dict[str, Any]]] = [None] * len(texts)
+        pending = []
+        for i, text in enumerate(texts):
+            local = self._local(text)
+            if local is not None:
+                local['latenza_ms'] = 0
+                results[i] = local
+            else:
+                pending.append(i)
+
+        for offset in range(0, len(pending), batch_size):
+            indices = pending[offset:offset + batch_size]
+            for i, result in zip(indices, self._analyze_chunk([texts[i] for i in indices])):
+                # No deadline here: a bulk run wants the model's answer, not a degraded guess
+                results[i] = (result if result is not None
+                              else self._analyze_remote(texts[i], None, time.time()))
+        return results
+
+    def _analyze_chunk(self, texts: List[str]) -> List[Optional[Dict[str, Any]]]:
+        """Run one batch request; None marks items that need a retry"""
+        start_time = time.time()
+        results: List[Optional[Dict[str, Any]]] = [None] * len(texts)
+        try:
+            response = VOLUMIO_MODEL.generate_content(self._create_batch_prompt(texts))
+            items = json.loads(self._clean_response(response.text))
+        except Exception as e:
+            logger.error(f"Batch analysis error: {e}")
+            return results
+        if not isinstance(items, list):
+            logger.error("Batch response is not a JSON array")
+            return results
+
+        latency = round((time.time() - start_time) * 1000)
+        for item in items:
+            if not isinstance(item, dict):
+                continue
+            index = item.pop("indice", None)
+            if (isinstance(index, int) and 0 <= index < len(texts) and results[index] is None
+                    and self._is_complete(item)):
+                self._store(texts[index], item)
+                self._learn(texts[index], item)
+                item['latenza_ms'] = latency
+                results[index] = item
+        return results
+
     @staticmethod
     def _create_error_response(error_message: str, start_time: float) -> Dict[str, Any]:
         """Create a standardized error response with latency"""
@@ -147,64 +2058,321 @@ class EmotionalAnalyzer:
             "latenza_ms": round((time.time() - start_time) * 1000)
         }
 
+class SpeculativeAnalyzer:
+    """Analyzes partial transcripts ahead of time and reuses the result if the final text matches"""
+    def __init__(self, analyzer: EmotionalAnalyzer, min_words: int = 3, similarity: float = 0.9,
+                 max_speculations: int = 3):
+        self.analyzer = analyzer
+        self.min_words = min_words
+        self.similarity = similarity
+        self.max_speculations = max_speculations
+        self.predicted_category: Optional[str] = None
+        self.speculations = 0
+        self._speculated = ""
+        self._future: Optional[Future] = None
+
+    def _matches(self, normalized: str) -> bool:
+        return normalized == self._speculated or _cosine(
+            _text_vector(normalized), _text_vector(self._speculated)) >= self.similarity
+
+    def on_partial(self, text: str) -> Optional[str]:
+        """Update the prediction for a partial transcript; returns the likely category"""
+        self.predicted_category = self.analyzer.keyword_index.best_match(text) or self.predicted_category
+        normalized = normalize_text(text)
+        if (len(normalized.split()) >= self.min_words and self.speculations < self.max_speculations
+                and not self._matches(normalized)):
+            # A superseded request still completes and warms the cache
+            self.speculations += 1
+            self._speculated = normalized
+            self._future = _submit_in_context(ANALYSIS_EXECUTOR, self._analyze, text)
+        return self.predicted_category
+
+    def _analyze(self, text: str) -> Dict[str, Any]:
+        # Calls the model directly: going through analyze would submit a second task
+        # to the executor and block this worker on it; the deadline applies in commit
+        start_time = time.time()
+        result = self.analyzer._local(text)
+        if result is not None:
+            result['latenza_ms'] = round((time.time() - start_time) * 1000)
+            return result
+        return self.analyzer._analyze_remote(text, None, start_time)
+
+    def commit(self, final_text: str, start_time: Optional[float] = None) -> Optional[Dict[str, Any]]:
+        """Speculative result if it was computed for (nearly) the final text, else None.
+
+        Waits for it until the analysis deadline counted from ``start_time``, then
+        answers with the degraded local response: the call already in flight is
+        the one that will warm the cache, a second request would only double the wait.
+        """
+        if self._future is None:
+            return None
+        if not self._matches(normalize_text(final_text)):
+            logger.info("Discarding speculative analysis: final transcript differs")
+            return None
+        start_time = start_time if start_time is not None else time.time()
+        deadline_s = self.analyzer.deadline_s
+        try:
+            result = self._future.result(
+                timeout=max(0.0, deadline_s - (time.time() - start_time)) if deadline_s else None)
+        except FutureTimeoutError:
+            logger.warning(f"Analysis deadline of {deadline_s}s exceeded, using local fallback")
+            return self.analyzer._create_degraded_response(final_text, start_time)
+        if result.get("degradato"):
+            return None
+        result["speculativo"] = True
+        return result
+
 @st.cache_data(ttl=3600)
+def _cached_volumio_response(user_input: str) -> str:
+    """Cached Volumio responses for common inputs; errors raise so they are never cached"""
+    response = VOLUMIO_MODEL.generate_content(
+        f"Risposta breve in italiano (max 2 righe) a: {user_input}")
+    if response and response.text:
+        return response.text
+    raise ValueError("Empty response from model")
+
 def get_volumio_response(user_input: str) -> str:
-    """Cached Volumio responses for common inputs"""
+    """Volumio reply for an input, with a fallback message on errors"""
     try:
-        response = VOLUMIO_MODEL.generate_content(
-            f"Risposta breve in italiano (max 2 righe) a: {user_input}")
-        
-        if response and response.text:
-            return response.text
-        else:
-            logger.error("Empty response from model")
-            return "Mi dispiace, non ho capito. Puoi ripetere?"
-            
+        return _cached_volumio_response(user_input)
+    except RemoteUnavailableError as e:
+        logger.warning(f"Volumio response skipped: {e}")
+        return "Il servizio è momentaneamente sovraccarico, riprova tra poco."
+    except ValueError as e:
+        logger.error(str(e))
+        return "Mi dispiace, non ho capito. Puoi ripetere?"
     except Exception as e:
         logger.error(f"Error in Volumio response: {e}")
         return "Mi dispiace, si è verificato un errore nella generazione della risposta."
 
+async def _run_in_thread(func, *args):
+    """Run a blocking call in a worker thread bound to the current Streamlit script context"""
+    ctx = get_script_run_ctx()
+
+    def _call():
+        if ctx is not None:
+            add_script_run_ctx(threading.current_thread(), ctx)
+        return func(*args)
+
+    return await asyncio.to_thread(_call)
+
+class VolumioPipeline:
+    """Async pipeline: transcription, then analysis and reply in parallel"""
+    def __init__(self, audio_processor: AudioProcessor, emotional_analyzer: EmotionalAnalyzer):
+        self.audio_processor = audio_processor
+        self.emotional_analyzer = emotional_analyzer
+
+    async def transcribe(self, audio_bytes: bytes) -> Tuple[str, bool]:
+        """Transcription stage"""
+        return await _run_in_thread(self.audio_processor.process, audio_bytes)
+
+    async def analyze(self, text: str,
+                      on_field: Optional[Callable[[str, Any], None]] = None,
+                      speculation: Optional[SpeculativeAnalyzer] = None) -> Dict[str, Any]:
+        """Emotional analysis stage, reusing a matching speculative analysis if any"""
+        if speculation is not None:
+            result = await _run_in_thread(speculation.commit, text, time.time())
+            if result is not None:
+                if on_field:
+                    for key, value in result.items():
+                        on_field(key, value)
+                return result
+        return await _run_in_thread(self.emotional_analyzer.analyze, text, on_field)
+
+    async def reply(self, text: str) -> str:
+        """Volumio reply stage"""
+        return await _run_in_thread(get_volumio_response, text)
+
+    async def run(self, audio_bytes: bytes,
+                  on_field: Optional[Callable[[str, Any], None]] = None) -> Dict[str, Any]:
+        """Run the full pipeline for one utterance"""
+        with TRACER.span("utterance"):
+            text, success = await self.transcribe(audio_bytes)
+            if not success:
+                return {"input": text, "success": False}
+            return await self._analyze_and_reply(text, on_field)
+
+    async def run_text(self, text: str,
+                       on_field: Optional[Callable[[str, Any], None]] = None,
+                       speculation: Optional[SpeculativeAnalyzer] = None) -> Dict[str, Any]:
+        """Run the pipeline for an utterance already transcribed while streaming"""
+        with TRACER.span("utterance"):
+            return await self._analyze_and_reply(text, on_field, speculation)
+
+    async def _analyze_and_reply(self, text: str,
+                                 on_field: Optional[Callable[[str, Any], None]],
+                                 speculation: Optional[SpeculativeAnalyzer] = None) -> Dict[str, Any]:
+        # Analysis and reply are independent: wall time is the slower of the two
+        analysis, reply = await asyncio.gather(self.analyze(text, on_field, speculation), self.reply(text))
+        return {"input": text, "success": True, "output": analysis, "reply": reply}
+
+# Interactions kept in memory per session; older ones are appended to VOLUMIO_HISTORY_SPILL if set
+HISTORY_SIZE = int(os.getenv('VOLUMIO_HISTORY_SIZE', '50'))
+HISTORY_SPILL_PATH = os.getenv('VOLUMIO_HISTORY_SPILL')
+
+@dataclass(slots=True)
+class HistoryRecord:
+    """One interaction shown in the history"""
+    type: str
+    input: str
+    output: Dict[str, Any]
+    created: float
+
+class InteractionHistory:
+    """Fixed-size ring buffer of interactions, spilling evicted records to a JSON-lines file"""
+    _spill_lock = threading.Lock()
+
+    def __init__(self, maxlen: int = HISTORY_SIZE, spill_path: Optional[str] = HISTORY_SPILL_PATH):
+        self._records: Deque[HistoryRecord] = deque(maxlen=maxlen)
+        self.spill_path = spill_path
+        self.total = 0
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def __iter__(self) -> Iterator[HistoryRecord]:
+        return iter(self._records)
+
+    @property
+    def last(self) -> Optional[HistoryRecord]:
+        return self._records[-1] if self._records else None
+
+    def append(self, type: str, input: str, output: Dict[str, Any]) -> HistoryRecord:
+        if len(self._records) == self._records.maxlen and self._records:
+            self._spill(self._records[0])
+        record = HistoryRecord(type, input, output, time.time())
+        self._records.append(record)
+        self.total += 1
+        return record
+
+    def recent(self, n: int) -> List[HistoryRecord]:
+        """Last n records, oldest first"""
+        return list(itertools.islice(reversed(self._records), n))[::-1]
+
+    def _spill(self, record: HistoryRecord):
+        if not self.spill_path:
+            return
+        line = json.dumps({"type": record.type, "input": record.input,
+                           "output": record.output, "created": record.created})
+        try:
+            with self._spill_lock, open(self.spill_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+        except OSError as e:
+            logger.error(f"History spill to {self.spill_path} failed: {e}")
+
 class VolumioDashboard:
     """Dashboard UI management"""
     def __init__(self):
         if "history" not in st.session_state:
-            st.session_state.history = []
+            st.session_state.history = InteractionHistory()
         
         self.audio_processor = AudioProcessor()
         self.emotional_analyzer = EmotionalAnalyzer()
+        if st.session_state.history:
+            # Last known mood for degraded answers
+            self.emotional_analyzer.last_result = st.session_state.history.last.output
+        self.pipeline = VolumioPipeline(self.audio_processor, self.emotional_analyzer)
 
     def render(self):
         """Render the dashboard"""
         st.title("🎵 Volumio AI Assistant")
-        self._render_audio_recorder()
-        self._render_history()
+        self._render_session()
+        with st.sidebar:
+            self._render_metrics()
+
+    @st.fragment
+    def _render_session(self):
+        """Render the recorder, the latest result and the history.
 
-    def _render_audio_recorder(self):
-        """Render audio recording section"""
+        A fragment: a new recording reruns only this section, which includes the
+        history so the new entry shows up right away.
+        """
+        if STREAMING_CAPTURE and webrtc_streamer is not None:
+            self._render_streaming_recorder()
+            return
         audio_bytes = audio_recorder(pause_threshold=2.0)
         
         if audio_bytes:
             with st.spinner("Analisi in corso..."):
                 self._process_audio(audio_bytes)
+        self._render_history()
+
+    def _render_streaming_recorder(self):
+        """Live capture: partial transcripts while speaking, analysis at end of speech"""
+        ctx = webrtc_streamer(key="volumio-stream", mode=WebRtcMode.SENDONLY,
+                              audio_receiver_size=256,
+                              media_stream_constraints={"audio": True, "video": False})
+        partial_placeholder = st.empty()
+        # One slot for the latest utterance: each new decision and analysis replaces the previous
+        result_placeholder = st.empty()
+        history_placeholder = st.empty()
+        with history_placeholder.container():
+            self._render_history()
+        transcriber = self.audio_processor.create_stream()
+        speculation = SpeculativeAnalyzer(self.emotional_analyzer)
+        while ctx.state.playing and ctx.audio_receiver:
+            try:
+                frames = ctx.audio_receiver.get_frames(timeout=1)
+            except queue.Empty:
+                continue
+            if not frames:
+                continue
+            # Packed s16 frames: (1, samples * channels)
+            channels = len(frames[0].layout.channels)
+            pcm = np.concatenate([frame.to_ndarray().reshape(-1) for frame in frames]).reshape(-1, channels)
+            previous = transcriber.partial
+            partial = transcriber.feed(pcm, frames[0].sample_rate)
+            if partial and partial != previous:
+                predicted = speculation.on_partial(partial)
+                partial_placeholder.caption(f"🎙️ {partial}" + (f" → {predicted}" if predicted else ""))
+            if transcriber.ended:
+                text, success = transcriber.finish()
+                partial_placeholder.empty()
+                with result_placeholder.container():
+                    if success:
+                        with st.spinner("Analisi in corso..."):
+                            result = asyncio.run(self.pipeline.run_text(
+                                text, self._decision_callback(), speculation))
+                    else:
+                        result = {"input": text, "success": False}
+                    self._handle_result(result)
+                with history_placeholder.container():
+                    self._render_history()
+                transcriber = self.audio_processor.create_stream()
+                speculation = SpeculativeAnalyzer(self.emotional_analyzer)
+
+    @staticmethod
+    def _decision_callback() -> Callable[[str, Any], None]:
+        """Callback surfacing the routing decision before the free-text fields are generated"""
+        decision_placeholder = st.empty()
+
+        def on_field(key: str, value: Any):
+            if key == "flow_consigliato":
+                decision_placeholder.success(f"Flow: {value}")
+
+        return on_field
 
     def _process_audio(self, audio_bytes: bytes):
         """Process recorded audio"""
-        text, success = self.audio_processor.process(audio_bytes)
-        
-        if success:
-            analysis = self.emotional_analyzer.analyze(text)
-            st.session_state.history.append({
-                "type": "analisi",
-                "input": text,
-                "output": analysis
-            })
+        self._handle_result(asyncio.run(self.pipeline.run(audio_bytes, self._decision_callback())))
+
+    def _handle_result(self, result: Dict[str, Any]):
+        """Store and display the outcome of one utterance"""
+        if result["success"]:
+            analysis = result["output"]
+            st.session_state.history.append("analisi", result["input"], analysis)
             
-            self._display_analysis(analysis)
+            with TRACER.span("render"):
+                self._display_analysis(analysis, result["reply"])
         else:
-            st.error(text)  # Display error message
+            st.error(result["input"])  # Display error message
 
-    def _display_analysis(self, analysis: Dict[str, Any]):
+    def _display_analysis(self, analysis: Dict[str, Any], reply: Optional[str] = None):
         """Display analysis results"""
+        if reply:
+            st.info(reply)
+        if analysis.get("degradato"):
+            st.warning("Risposta rapida locale: l'analisi completa non è arrivata in tempo.")
         st.subheader("Risultati Analisi")
         st.json(analysis)
 
@@ -212,9 +2380,33 @@ class VolumioDashboard:
         """Render interaction history"""
         if st.session_state.history:
             st.subheader("Cronologia Interazioni")
-            for item in st.session_state.history[-5:]:  # Show last 5 interactions
-                st.text(f"Input: {item['input']}")
-                st.json(item['output'])
+            for item in st.session_state.history.recent(5):  # Show last 5 interactions
+                st.text(f"Input: {item.input}")
+                st.json(item.output)
+
+    @st.fragment(run_every=5)
+    def _render_metrics(self):
+        """Render per-stage latency percentiles, refreshed on a timer: recordings only
+        rerun the session fragment"""
+        stats = TRACER.percentiles()
+        if not stats:
+            return
+        st.subheader("Latenze (ms)")
+        st.dataframe(
+            [{"stage": name, **values} for name, values in sorted(stats.items())],
+            hide_index=True)
+        st.caption("Dipendenze remote")
+        st.dataframe(
+            [{"servizio": guard.name, **guard.status()} for guard in (GEMINI_GUARD, SPEECH_GUARD)],
+            hide_index=True)
+        st.caption("Classificatore locale")
+        st.dataframe([self.emotional_analyzer.agreement.status()], hide_index=True)
+        st.caption("Risorse condivise")
+        st.dataframe(RESOURCES.status(), hide_index=True)
+        st.download_button("Metriche Prometheus", TRACER.prometheus(),
+                           file_name="metrics.txt", mime="text/plain")
+        st.download_button("Trace (JSON)", json.dumps(TRACER.export_spans()),
+                           file_name="traces.json", mime="application/json")
 
 def main():
     """Main application entry point"""
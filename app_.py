@@ -19,10 +19,15 @@ volumio_model = genai.GenerativeModel("gemini-2.0-flash-exp")
 if "history" not in st.session_state:
     st.session_state.history = []
 
+@st.cache_resource
+def get_recognizer() -> sr.Recognizer:
+    """Recognizer condiviso tra rerun e sessioni"""
+    return sr.Recognizer()
+
 class AudioProcessor:
     """Elaborazione audio e riconoscimento vocale"""
     def process(self, audio_bytes: bytes) -> str:
-        recognizer = sr.Recognizer()
+        recognizer = get_recognizer()
         try:
             with io.BytesIO(audio_bytes) as audio_file:
                 with sr.AudioFile(audio_file) as source:
@@ -0,0 +1 @@
+"""Offline benchmarks with local Gemini and speech recognition stand-ins"""
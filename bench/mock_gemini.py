@@ -0,0 +1,135 @@
+"""Local stand-in for the Gemini REST API with configurable latency and jitter"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import json
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+# Keyword -> category used to produce plausible analyses
+_KEYWORDS = {
+    "corr": "Running", "cucin": "Kitchen", "rilass": "Relaxing",
+    "lavor": "Working", "studi": "Working", "passeg": "Walking", "cammin": "Walking"
+}
+_BPM = {"Running": "120-140", "Kitchen": "80-100", "Ambient": "60-80",
+        "Relaxing": "50-70", "Working": "90-110", "Walking": "100-120"}
+
+def _analysis(text: str) -> Dict[str, Any]:
+    """Deterministic analysis for an input text"""
+    category = next((cat for key, cat in _KEYWORDS.items() if key in text.lower()), "Ambient")
+    return {
+        "flow_consigliato": category,
+        "bpm_range": f"{_BPM[category]} BPM",
+        "caratteristiche": ["mock"],
+        "esempi_genere": ["mock"],
+        "percezione_emotiva": "risposta simulata",
+        "reasoning": "Risposta generata dal server di benchmark"
+    }
+
+def _reply_text(prompt: str) -> str:
+    """Model output for a prompt, following the prompts built by app.py"""
+    if prompt.startswith("Risposta breve"):
+        return "Certo, ecco la musica giusta per te."
+    if "array JSON" in prompt:
+        inputs = prompt.rsplit("Analizza ora questi input:", 1)[-1].strip().splitlines()
+        items = []
+        for line in inputs:
+            index, _, text = line.partition(": ")
+            items.append(dict(_analysis(text), indice=int(index)))
+        return json.dumps(items)
+    return "```json\n" + json.dumps(_analysis(prompt.rsplit(":", 1)[-1]), indent=2) + "\n```"
+
+def _candidate(text: str) -> Dict[str, Any]:
+    return {"candidates": [{"content": {"parts": [{"text": text}], "role": "model"},
+                            "finishReason": "STOP", "index": 0}]}
+
+class MockGeminiServer:
+    """Threaded HTTP server answering generateContent and streamGenerateContent"""
+    def __init__(self, latency_ms: float = 300, jitter_ms: float = 100,
+                 chunks: int = 4, seed: int = 0, port: int = 0):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.chunks = chunks
+        self.requests = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def endpoint(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def delay(self) -> float:
+        """Sample one response delay in seconds"""
+        with self._lock:
+            self.requests += 1
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0.0, self.latency_ms + jitter) / 1000
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                prompt = "".join(part.get("text", "")
+                                 for content in body.get("contents", [])
+                                 for part in content.get("parts", []))
+                text = _reply_text(prompt)
+                delay = server.delay()
+                if ":streamGenerateContent" in self.path:
+                    self._stream(text, delay)
+                else:
+                    time.sleep(delay)
+                    self._send(json.dumps(_candidate(text)).encode())
+
+            def _send(self, payload: bytes):
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def _stream(self, text: str, delay: float):
+                # First chunk after half the delay, the rest spread over the other half
+                parts = _split(text, server.chunks)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.end_headers()
+                time.sleep(delay / 2)
+                for i, part in enumerate(parts):
+                    if i:
+                        time.sleep(delay / 2 / max(1, len(parts) - 1))
+                    prefix = "[" if i == 0 else ","
+                    self.wfile.write((prefix + json.dumps(_candidate(part))).encode())
+                    self.wfile.flush()
+                self.wfile.write(b"]")
+
+        return Handler
+
+    def start(self) -> "MockGeminiServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+def _split(text: str, chunks: int) -> List[str]:
+    """Split a text into roughly equal chunks"""
+    size = max(1, -(-len(text) // max(1, chunks)))
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+def configure_environment(server: MockGeminiServer):
+    """Point app.py's Gemini client at the mock server; call before importing app"""
+    os.environ["VOLUMIO_GEMINI_TRANSPORT"] = "rest"
+    os.environ["VOLUMIO_GEMINI_ENDPOINT"] = server.endpoint
+    os.environ.setdefault("GEMINI_API", "bench")
@@ -0,0 +1,223 @@
+"""Offline benchmark for the Volumio pipeline.
+
+Drives ``AudioProcessor.process``, ``EmotionalAnalyzer.analyze`` and
+``VolumioDashboard._process_audio`` against a local mock Gemini server and a
+mock recognizer, and reports throughput, latency percentiles, CPU time and
+peak RSS.
+
+    python -m bench.run --iterations 50 --concurrency 4 --json bench_output.txt
+"""
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
+import io
+import json
+import logging
+import os
+from pathlib import Path
+import random
+import resource
+import sys
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+import wave
+
+import numpy as np
+
+from bench.mock_gemini import MockGeminiServer, configure_environment
+
+# Phrases the mock recognizer returns, chosen deterministically per clip
+PHRASES = [
+    "vado a correre",
+    "sto cucinando per gli amici",
+    "ho avuto una giornata stressante",
+    "devo concentrarmi sul lavoro",
+    "faccio una passeggiata al parco",
+    "mi sento un po' malinconico stasera",
+    "voglio qualcosa di atmosferico",
+    "non so cosa ascoltare"
+]
+
+def synthetic_corpus(count: int, seed: int = 0, sample_rate: int = 44100) -> List[bytes]:
+    """WAV clips with a voiced burst between silence, like audio_recorder output"""
+    rng = np.random.default_rng(seed)
+    clips = []
+    for _ in range(count):
+        duration = rng.uniform(2.5, 5.0)
+        t = np.arange(int(duration * sample_rate)) / sample_rate
+        signal = rng.normal(0, 0.002, t.size)
+        start, end = int(0.5 * sample_rate), int((duration - 2.0) * sample_rate)
+        signal[start:end] += 0.3 * np.sin(2 * np.pi * rng.uniform(120, 300) * t[start:end])
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(sample_rate)
+            wav.writeframes((np.clip(signal, -1, 1) * 32767).astype("<i2").tobytes())
+        clips.append(buffer.getvalue())
+    return clips
+
+def load_corpus(directory: Path) -> List[Dict[str, Any]]:
+    """WAV clips from a directory, with the reference transcript from a sibling .txt if any"""
+    corpus = []
+    for path in sorted(directory.glob("*.wav")):
+        reference = path.with_suffix(".txt")
+        corpus.append({
+            "name": path.name,
+            "audio": path.read_bytes(),
+            "reference": reference.read_text(encoding="utf-8").strip() if reference.exists() else None
+        })
+    return corpus
+
+def word_error_rate(reference: str, hypothesis: str) -> float:
+    """Word-level Levenshtein distance divided by the reference length"""
+    ref, hyp = reference.lower().split(), hypothesis.lower().split()
+    distances = list(range(len(hyp) + 1))
+    for i, ref_word in enumerate(ref, 1):
+        previous, distances[0] = distances[0], i
+        for j, hyp_word in enumerate(hyp, 1):
+            previous, distances[j] = distances[j], min(
+                distances[j] + 1, distances[j - 1] + 1, previous + (ref_word != hyp_word))
+    return distances[-1] / max(1, len(ref))
+
+def make_mock_backend(app, latency_ms: float, jitter_ms: float, seed: int):
+    """SpeechBackend with simulated latency returning a phrase chosen by clip content"""
+    class MockSpeechBackend(app.SpeechBackend):
+        name = "mock"
+
+        def __init__(self):
+            self._random = random.Random(seed)
+            self._lock = threading.Lock()
+
+        def transcribe(self, audio) -> str:
+            with self._lock:
+                jitter = self._random.uniform(-jitter_ms, jitter_ms)
+            time.sleep(max(0.0, latency_ms + jitter) / 1000)
+            digest = hashlib.sha1(audio.frame_data).digest()
+            return PHRASES[digest[0] % len(PHRASES)]
+
+    return MockSpeechBackend()
+
+def measure(name: str, func: Callable[[Any], Any], items: List[Any],
+            iterations: int, concurrency: int) -> Dict[str, Any]:
+    """Run func over items for the given iterations and collect statistics"""
+    workload = [items[i % len(items)] for i in range(iterations)]
+    latencies: List[float] = []
+    lock = threading.Lock()
+
+    def timed(item):
+        start = time.perf_counter()
+        func(item)
+        elapsed = (time.perf_counter() - start) * 1000
+        with lock:
+            latencies.append(elapsed)
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(timed, workload))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        "target": name,
+        "calls": len(latencies),
+        "throughput_per_s": round(len(latencies) / wall, 2),
+        "p50_ms": round(p50, 1),
+        "p95_ms": round(p95, 1),
+        "p99_ms": round(p99, 1),
+        "cpu_s": round(cpu, 3),
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    }
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", type=Path, help="directory of WAV clips (default: synthetic)")
+    parser.add_argument("--clips", type=int, default=8, help="number of synthetic clips")
+    parser.add_argument("--iterations", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--targets", default="process,analyze,pipeline",
+                        help="comma-separated subset of process, analyze, pipeline")
+    parser.add_argument("--gemini-latency", type=float, default=300, help="mock model latency (ms)")
+    parser.add_argument("--gemini-jitter", type=float, default=100, help="mock model jitter (ms)")
+    parser.add_argument("--stt-latency", type=float, default=400, help="mock recognizer latency (ms)")
+    parser.add_argument("--stt-jitter", type=float, default=100, help="mock recognizer jitter (ms)")
+    parser.add_argument("--backend", help="use a real speech backend (google, vosk, whisper_cpp) instead of the mock")
+    parser.add_argument("--cold", action="store_true", help="disable the keyword fast path and caches")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", type=Path, help="also write the report as JSON to this file")
+    return parser.parse_args(argv)
+
+def main(argv: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    args = parse_args(argv)
+    os.environ.setdefault("VOLUMIO_STT_BACKEND", "stub")
+    # Results persisted by earlier runs would turn every call into a cache hit
+    os.environ.setdefault("VOLUMIO_CACHE_PATH", "")
+    logging.disable(logging.WARNING)
+
+    server = MockGeminiServer(args.gemini_latency, args.gemini_jitter, seed=args.seed).start()
+    configure_environment(server)
+    import app
+
+    if args.corpus:
+        corpus = load_corpus(args.corpus)
+    else:
+        corpus = [{"name": f"synthetic_{i}.wav", "audio": audio, "reference": None}
+                  for i, audio in enumerate(synthetic_corpus(args.clips, args.seed))]
+    if not corpus:
+        sys.exit(f"No WAV clips found in {args.corpus}")
+    clips = [item["audio"] for item in corpus]
+
+    if args.backend:
+        processor = app.AudioProcessor()
+        processor.backend = app.create_speech_backend(args.backend, processor.recognizer, app.STT_MODEL)
+    else:
+        processor = app.AudioProcessor(make_mock_backend(app, args.stt_latency, args.stt_jitter, args.seed))
+    analyzer = app.EmotionalAnalyzer(
+        cache=app.SemanticCache(maxsize=0) if args.cold else app.SemanticCache(),
+        keyword_index=app.KeywordIndex({}) if args.cold else None,
+        classifier=app.MoodClassifier(app.MUSIC_CATEGORIES) if args.cold else None,
+        agreement=app.AgreementMonitor(float("inf"), min_samples=sys.maxsize) if args.cold else None)
+
+    targets = args.targets.split(",")
+    report = []
+    if "process" in targets:
+        report.append(measure("AudioProcessor.process", processor.process, clips,
+                              args.iterations, args.concurrency))
+        references = [(item["reference"], item["audio"]) for item in corpus if item["reference"]]
+        if references:
+            errors = [word_error_rate(ref, processor.process(audio)[0]) for ref, audio in references]
+            report[-1]["wer"] = round(sum(errors) / len(errors), 3)
+    if "analyze" in targets:
+        report.append(measure("EmotionalAnalyzer.analyze", analyzer.analyze, PHRASES,
+                              args.iterations, args.concurrency))
+    if "pipeline" in targets:
+        dashboard = app.VolumioDashboard()
+        dashboard.audio_processor.backend = processor.backend
+        dashboard.emotional_analyzer.cache = analyzer.cache
+        dashboard.emotional_analyzer.keyword_index = analyzer.keyword_index
+        dashboard.emotional_analyzer.classifier = analyzer.classifier
+        dashboard.emotional_analyzer.agreement = analyzer.agreement
+        if args.cold:
+            app._cached_volumio_response.clear()
+        # Streamlit session state is per script run, so the pipeline is driven serially
+        report.append(measure("VolumioDashboard._process_audio", dashboard._process_audio, clips,
+                              args.iterations, 1))
+
+    server.stop()
+    print(f"{'target':34} {'calls':>6} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'cpu_s':>7} {'rss_mb':>7}")
+    for row in report:
+        print(f"{row['target']:34} {row['calls']:>6} {row['throughput_per_s']:>8} {row['p50_ms']:>8} "
+              f"{row['p95_ms']:>8} {row['p99_ms']:>8} {row['cpu_s']:>7} {row['peak_rss_mb']:>7}"
+              + (f"  wer={row['wer']}" if "wer" in row else ""))
+    print(f"mock gemini requests: {server.requests}")
+    if args.json:
+        args.json.write_text(json.dumps({"args": {k: str(v) for k, v in vars(args).items()},
+                                         "results": report,
+                                         "stages": app.TRACER.percentiles()}, indent=2))
+    return report
+
+if __name__ == "__main__":
+    main()
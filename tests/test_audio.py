@@ -0,0 +1,53 @@
+import os
+
+os.environ.setdefault("VOLUMIO_CACHE_PATH", "")
+os.environ.setdefault("VOLUMIO_STT_BACKEND", "stub")
+
+import numpy as np
+import pytest
+
+import app
+
+
+@pytest.mark.parametrize("sample_rate,chunk", [(48000, 960), (44100, 441), (16000, 320)])
+def test_chunked_resampling_matches_one_shot(sample_rate, chunk):
+    rng = np.random.default_rng(0)
+    t = np.arange(sample_rate) / sample_rate
+    pcm = (8000 * np.sin(2 * np.pi * 440 * t) + 2000 * rng.normal(size=t.size)).astype(np.int16)
+    pcm = pcm.reshape(-1, 1)
+    expected, _ = app.to_stt_format(pcm, sample_rate, 32768.0)
+    resampler = app.StreamingResampler(sample_rate)
+    chunks = [resampler.process(pcm[i:i + chunk]) for i in range(0, len(pcm), chunk)]
+    streamed = np.concatenate(chunks)
+    # The streamed output lags by half the filter length at the very end
+    n = len(streamed) - 32
+    assert len(expected) - len(streamed) < 32
+    assert np.abs(expected[:n].astype(int) - streamed[:n]).max() <= 1
+
+
+def test_backend_missing_transcribe_fails_when_built():
+    class Incomplete(app.SpeechBackend):
+        name = "incomplete"
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_clip_without_pauses_is_kept_whole():
+    sample_rate = 16000
+    t = np.arange(2 * sample_rate) / sample_rate
+    tone = 0.25 * np.sin(2 * np.pi * 220 * t)
+    noise = np.random.default_rng(0).normal(0, 0.1, t.size) * (1 + 0.5 * np.sin(2 * np.pi * 3 * t))
+    vad = app.VoiceActivityDetector()
+    for signal in (tone, noise):
+        assert vad.voiced_range(signal.reshape(-1, 1), sample_rate) == (0, t.size)
+
+
+def test_silence_around_speech_is_trimmed():
+    sample_rate = 16000
+    signal = np.random.default_rng(0).normal(0, 0.002, 3 * sample_rate)
+    t = np.arange(sample_rate) / sample_rate
+    signal[sample_rate:2 * sample_rate] += 0.3 * np.sin(2 * np.pi * 220 * t)
+    start, end = app.VoiceActivityDetector(padding_ms=0).voiced_range(signal.reshape(-1, 1), sample_rate)
+    assert abs(start - sample_rate) <= 320 and abs(end - 2 * sample_rate) <= 320
+    assert app.VoiceActivityDetector().voiced_range(np.zeros((sample_rate, 1)), sample_rate) is None
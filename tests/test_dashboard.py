@@ -0,0 +1,55 @@
+import os
+
+os.environ.setdefault("VOLUMIO_CACHE_PATH", "")
+os.environ.setdefault("VOLUMIO_STT_BACKEND", "stub")
+
+from streamlit.testing.v1 import AppTest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def recording_app(root):
+    import inspect
+    import io
+    import sys
+    import wave
+
+    import numpy as np
+    import streamlit as st
+
+    sys.path.insert(0, root)
+    import app
+
+    def fake_recorder(**kwargs):
+        # A different clip on every run, as if the user recorded again
+        st.session_state.recordings = st.session_state.get("recordings", 0) + 1
+        t = np.arange(16000) / 16000
+        signal = 0.3 * np.sin(2 * np.pi * (200 + st.session_state.recordings) * t)
+        buffer = io.BytesIO()
+        with wave.open(buffer, "wb") as wav:
+            wav.setnchannels(1)
+            wav.setsampwidth(2)
+            wav.setframerate(16000)
+            wav.writeframes((signal * 32767).astype("<i2").tobytes())
+        return buffer.getvalue()
+
+    def render_history(self, original=app.VolumioDashboard._render_history):
+        # Recordings rerun only the session fragment, so the history must be drawn inside it
+        st.session_state.history_in_session = any(
+            frame.function == "_render_session" for frame in inspect.stack())
+        original(self)
+
+    app.audio_recorder = fake_recorder
+    app.get_volumio_response = lambda text: "ok"
+    app.VolumioDashboard._render_history = render_history
+    app.main()
+
+
+def test_new_recordings_appear_in_the_history():
+    at = AppTest.from_function(recording_app, args=(ROOT,), default_timeout=60)
+    at.run()
+    at.run()
+    assert not at.exception
+    inputs = [element.value for element in at.text if element.value.startswith("Input:")]
+    assert len(inputs) == 2
+    assert at.session_state.history_in_session
@@ -0,0 +1,74 @@
+import json
+import os
+import time
+
+os.environ.setdefault("VOLUMIO_CACHE_PATH", "")
+os.environ.setdefault("VOLUMIO_STT_BACKEND", "stub")
+
+import app
+
+ANALYSIS = {"flow_consigliato": "Relaxing", "bpm_range": "50-70 BPM", "caratteristiche": ["calma"],
+            "esempi_genere": ["ambient"], "percezione_emotiva": "stanchezza", "reasoning": "test"}
+
+
+def feed_in_chunks(parser, text, size=7):
+    completed = []
+    for i in range(0, len(text), size):
+        completed += parser.feed(text[i:i + size])
+    return completed
+
+
+def test_fields_are_emitted_as_they_complete():
+    parser = app.IncrementalJSONParser()
+    completed = feed_in_chunks(parser, "```json\n" + json.dumps(ANALYSIS, indent=2) + "\n```")
+    assert parser.complete
+    assert [key for key, _ in completed] == list(ANALYSIS)
+    assert parser.fields == ANALYSIS
+
+
+def test_top_level_array_is_not_taken_as_the_object():
+    parser = app.IncrementalJSONParser()
+    feed_in_chunks(parser, '["a", "b"]')
+    assert not parser.complete
+    assert parser.fields == {}
+
+
+class FakeModel:
+    def __init__(self, text, delay_s=0.0):
+        self.text = text
+        self.delay_s = delay_s
+
+    def generate_content(self, prompt, stream=False):
+        time.sleep(self.delay_s)
+        return iter([self]) if stream else self
+
+
+def analyze_reply(monkeypatch, reply):
+    monkeypatch.setattr(app, "VOLUMIO_MODEL", FakeModel(reply))
+    analyzer = app.EmotionalAnalyzer(cache=app.SemanticCache(), keyword_index=app.KeywordIndex({}),
+                                     classifier=app.MoodClassifier(app.MUSIC_CATEGORIES),
+                                     deadline_s=None)
+    return analyzer, analyzer.analyze("una frase qualsiasi")
+
+
+def test_incomplete_reply_is_an_error_and_not_cached(monkeypatch):
+    analyzer, result = analyze_reply(monkeypatch, '[{"flow_consigliato": "Relaxing"}]')
+    assert result["caratteristiche"] == ["fallback_mode"]
+    assert analyzer.cache.get("una frase qualsiasi") is None
+
+
+def test_complete_reply_is_cached(monkeypatch):
+    analyzer, result = analyze_reply(monkeypatch, json.dumps(ANALYSIS))
+    assert result["flow_consigliato"] == "Relaxing"
+    assert analyzer.cache.get("una frase qualsiasi")["reasoning"] == "test"
+
+
+def test_batch_retries_wait_for_the_model(monkeypatch):
+    # The batch reply is not an array, so every item is retried individually
+    monkeypatch.setattr(app, "VOLUMIO_MODEL", FakeModel(json.dumps(ANALYSIS), delay_s=0.1))
+    analyzer = app.EmotionalAnalyzer(cache=app.SemanticCache(), keyword_index=app.KeywordIndex({}),
+                                     classifier=app.MoodClassifier(app.MUSIC_CATEGORIES),
+                                     deadline_s=0.01)
+    results = analyzer.analyze_batch(["prima frase", "seconda frase"])
+    assert [r["reasoning"] for r in results] == ["test", "test"]
+    assert not any(r.get("degradato") for r in results)
@@ -0,0 +1,47 @@
+import os
+
+os.environ.setdefault("VOLUMIO_CACHE_PATH", "")
+os.environ.setdefault("VOLUMIO_STT_BACKEND", "stub")
+
+import app
+
+
+def test_negation_survives_normalization():
+    assert app.normalize_text("non voglio rilassarmi") != app.normalize_text("voglio rilassarmi")
+
+
+def test_negated_text_does_not_hit_the_positive_cache_entry():
+    cache = app.SemanticCache()
+    cache.put("voglio rilassarmi", {"flow_consigliato": "Relaxing"})
+    assert cache.get("non voglio rilassarmi") is None
+
+
+def test_long_negated_text_does_not_hit_the_positive_cache_entry():
+    cache = app.SemanticCache()
+    positive = ["musica per lavorare con calma",
+                "stasera sono stanco ma devo studiare tutta la notte"]
+    for text in positive:
+        cache.put(text, {"flow_consigliato": "Working"})
+    assert cache.get("musica per non lavorare con calma") is None
+    assert cache.get("stasera sono stanco ma non devo studiare tutta la notte") is None
+    assert cache.get("della musica per lavorare con calma") is not None
+
+
+def test_negated_keyword_is_left_to_the_model():
+    assert app.KEYWORD_INDEX.match("voglio correre") == "Running"
+    assert app.KEYWORD_INDEX.match("non ho voglia di correre") is None
+
+
+def test_keywords_match_whole_tokens_only():
+    for text in ["voglio cantare", "vorrei sentire un concerto", "sono sotto pressione",
+                 "il caffè è corretto", "ho un motivo per festeggiare"]:
+        assert app.KEYWORD_INDEX.classify(text) is None, text
+    assert app.KEYWORD_INDEX.match("faccio una passeggiata al parco") == "Walking"
+
+
+def test_negated_text_is_not_answered_by_the_classifier():
+    analyzer = app.EmotionalAnalyzer(cache=app.SemanticCache(), audit_rate=0)
+    assert analyzer.classifier.classify("voglio correre", 0.5) is not None
+    for text in ["non voglio correre", "non sono stressato, voglio ballare",
+                 "non ho voglia di studiare"]:
+        assert analyzer._local(text) is None, text
@@ -0,0 +1,47 @@
+import asyncio
+import json
+import os
+import threading
+import time
+
+os.environ.setdefault("VOLUMIO_CACHE_PATH", "")
+os.environ.setdefault("VOLUMIO_STT_BACKEND", "stub")
+
+import app
+
+ANALYSIS = {"flow_consigliato": "Relaxing", "bpm_range": "50-70 BPM", "caratteristiche": ["calma"],
+            "esempi_genere": ["ambient"], "percezione_emotiva": "stanchezza", "reasoning": "test"}
+
+
+class SlowModel:
+    def __init__(self, delay_s):
+        self.delay_s = delay_s
+        self.calls = 0
+        self.text = json.dumps(ANALYSIS)
+        self._lock = threading.Lock()
+
+    def generate_content(self, prompt, stream=False):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay_s)
+        return iter([self])
+
+
+def test_speculation_past_the_deadline_degrades_without_a_second_request(monkeypatch):
+    model = SlowModel(delay_s=0.6)
+    monkeypatch.setattr(app, "VOLUMIO_MODEL", model)
+    analyzer = app.EmotionalAnalyzer(cache=app.SemanticCache(), keyword_index=app.KeywordIndex({}),
+                                     classifier=app.MoodClassifier(app.MUSIC_CATEGORIES),
+                                     deadline_s=0.2)
+    pipeline = app.VolumioPipeline(app.AudioProcessor(app.StubSpeechBackend()), analyzer)
+    speculation = app.SpeculativeAnalyzer(analyzer, min_words=1)
+    text = "una frase qualsiasi da analizzare"
+    speculation.on_partial(text)
+
+    start = time.perf_counter()
+    result = asyncio.run(pipeline.analyze(text, None, speculation))
+    elapsed = time.perf_counter() - start
+
+    assert result.get("degradato")
+    assert elapsed < 0.4
+    assert model.calls == 1
@@ -0,0 +1,88 @@
+import os
+
+os.environ.setdefault("VOLUMIO_CACHE_PATH", "")
+os.environ.setdefault("VOLUMIO_STT_BACKEND", "stub")
+
+import pytest
+
+import app
+
+
+def open_guard(limit=8):
+    guard = app.RemoteGuard("test", app.CircuitBreaker("test", min_calls=1, reset_timeout_s=0),
+                            app.AdaptiveLimiter(initial=limit))
+    guard.release(guard.acquire(), False)
+    assert guard.breaker.state == "open"
+    return guard
+
+
+def test_failures_open_the_circuit():
+    guard = app.RemoteGuard("test", app.CircuitBreaker("test", min_calls=2, reset_timeout_s=60))
+    for _ in range(2):
+        guard.release(guard.acquire(), False)
+    assert guard.breaker.state == "open"
+    with pytest.raises(app.RemoteUnavailableError):
+        guard.acquire()
+
+
+def test_successful_probe_closes_the_circuit():
+    guard = open_guard()
+    start = guard.acquire()
+    assert guard.breaker.state == "half_open"
+    with pytest.raises(app.RemoteUnavailableError):
+        guard.acquire()  # only one probe at a time
+    guard.release(start, True)
+    assert guard.breaker.state == "closed"
+
+
+def test_failed_probe_reopens_the_circuit():
+    guard = open_guard()
+    guard.release(guard.acquire(), False)
+    assert guard.breaker.state == "open"
+
+
+def test_abandoned_probe_lets_another_probe_through():
+    guard = open_guard()
+    guard.release(guard.acquire(), None)
+    assert guard.breaker.state == "half_open"
+    guard.release(guard.acquire(), True)
+    assert guard.breaker.state == "closed"
+
+
+def test_probe_rejected_by_the_limiter_is_released():
+    guard = open_guard(limit=1)
+    guard.limiter.in_flight = 1  # saturated by a call admitted before the circuit opened
+    with pytest.raises(app.RemoteUnavailableError, match="concurrency limit"):
+        guard.acquire()
+    guard.limiter.in_flight = 0
+    guard.release(guard.acquire(), True)
+    assert guard.breaker.state == "closed"
+
+
+def test_limiter_halves_on_failure_and_ignores_cancelled_calls():
+    limiter = app.AdaptiveLimiter(initial=8)
+    assert limiter.try_acquire()
+    limiter.release(None, 0.0)
+    assert limiter.limit == 8
+    assert limiter.try_acquire()
+    limiter.release(False, 0.0)
+    assert limiter.limit == 4
+    assert limiter.in_flight == 0
+
+
+def test_client_rejects_instead_of_waiting_for_a_slot():
+    client = app.GeminiClient("test-model", None, max_in_flight=1,
+                              guard=app.RemoteGuard("test"))
+    client._acquire()
+    with pytest.raises(app.RemoteUnavailableError):
+        client.generate_content("prompt")
+    assert client.guard.limiter.in_flight == 0
+    client._release()
+
+
+def test_unstarted_stream_holds_no_slot():
+    client = app.GeminiClient("test-model", None, guard=app.RemoteGuard("test"))
+    stream = client.generate_content("prompt", stream=True)
+    del stream
+    assert client.in_flight == 0
+    assert client.guard.limiter.in_flight == 0
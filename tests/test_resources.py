@@ -0,0 +1,44 @@
+import os
+import threading
+import time
+
+os.environ.setdefault("VOLUMIO_CACHE_PATH", "")
+os.environ.setdefault("VOLUMIO_STT_BACKEND", "stub")
+
+import app
+
+
+def wait_for_probe(registry, name):
+    while registry._entries[name].probing:
+        time.sleep(0.01)
+
+
+def test_resource_is_built_once():
+    registry = app.ResourceRegistry()
+    first = registry.get("thing", object)
+    assert registry.get("thing", object) is first
+
+
+def test_unhealthy_resource_is_closed_and_rebuilt():
+    registry = app.ResourceRegistry(check_interval=0)
+    closed = []
+    healthy = {"value": True}
+    first = registry.get("thing", object, health=lambda _: healthy["value"], close=closed.append)
+    healthy["value"] = False
+    registry._check("thing", registry._entries["thing"])  # runs in the background
+    wait_for_probe(registry, "thing")
+    second = registry.get("thing", object)
+    assert second is not first
+    assert closed == [first]
+
+
+def test_slow_factory_does_not_block_other_resources():
+    registry = app.ResourceRegistry()
+    release = threading.Event()
+    builder = threading.Thread(target=registry.get, args=("slow", lambda: release.wait(5)))
+    builder.start()
+    start = time.perf_counter()
+    registry.get("fast", object)
+    assert time.perf_counter() - start < 1
+    release.set()
+    builder.join()
@@ -0,0 +1,52 @@
+import os
+import urllib.request
+
+os.environ.setdefault("VOLUMIO_CACHE_PATH", "")
+os.environ.setdefault("VOLUMIO_STT_BACKEND", "stub")
+
+import pytest
+
+import app
+
+
+class RecordingSpan:
+    def __init__(self):
+        self.exit_args = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.exit_args = args
+
+
+class RecordingTracer:
+    def __init__(self):
+        self.spans = []
+
+    def start_as_current_span(self, name, attributes=None):
+        self.spans.append(RecordingSpan())
+        return self.spans[-1]
+
+
+def test_failed_stage_is_reported_as_an_error():
+    tracer = app.Tracer()
+    tracer._otel = RecordingTracer()
+    with pytest.raises(ValueError):
+        with tracer.span("stage"):
+            raise ValueError("boom")
+    assert tracer._otel.spans[0].exit_args[0] is ValueError
+    assert tracer.export_spans()[0]["status"] == "ERROR"
+
+
+def test_metrics_endpoint_serves_stage_latencies():
+    tracer = app.Tracer()
+    with tracer.span("stage"):
+        pass
+    server = app.MetricsServer(tracer, 0, host="127.0.0.1").start()
+    try:
+        port = server._server.server_address[1]
+        body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode()
+    finally:
+        server.stop()
+    assert 'volumio_stage_latency_ms_count{stage="stage"} 1' in body